@@ -2,6 +2,7 @@
 from pathlib import Path
 from datetime import timedelta
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -74,6 +75,10 @@ if DEBUG:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            # take the write lock when a transaction starts and wait for it, so concurrent checkouts queue up
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
+            # file database for tests, threads of the concurrency tests can not share an in memory one
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
         }}
     
 else:
@@ -88,6 +93,30 @@ else:
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# cached categories, carts, catalog responses and authenticated users are invalidated by version tokens kept in
+# the default cache, so every process has to share it: configure a redis cache with REDIS_URL. The per process
+# memory cache only fits a single process development server (DEBUG), each process would keep stale copies.
+
+SHARED_CACHE = bool(config('REDIS_URL', default=''))
+
+if SHARED_CACHE:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': config('REDIS_URL'),
+        }
+    }
+elif not DEBUG:
+    raise ImproperlyConfigured('REDIS_URL must be set when DEBUG is off, the processes need a shared cache.')
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -137,21 +166,35 @@ AUTH_USER_MODEL = 'Store.User'  # User model is my CustomUser model
 
 REST_FRAMEWORK={
   'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'Store.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
 }
 
+# product views are buffered in memory and written in batches every this many seconds, 0 writes every view at once
+PRODUCT_VIEWS_FLUSH_INTERVAL = config('PRODUCT_VIEWS_FLUSH_INTERVAL', default=10, cast=int)
+
+# stock of a pending order is held this long, the release_expired_orders command gives it back afterwards
+ORDER_RESERVATION_MINUTES = config('ORDER_RESERVATION_MINUTES', default=30, cast=int)
+
+# threads rendering resized / webp copies of uploaded images, 0 renders them in the request
+IMAGE_PROCESSING_WORKERS = config('IMAGE_PROCESSING_WORKERS', default=2, cast=int)
+
 # JWT configuration
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=5),
     'ALGORITHM': 'HS256',
+    'TOKEN_REFRESH_SERIALIZER': 'Store.authentication.CachedTokenRefreshSerializer',
 }
 
+# authenticated users are read from a per process cache for this many seconds, from the shared cache for longer
+AUTH_USER_LOCAL_TIMEOUT = config('AUTH_USER_LOCAL_TIMEOUT', default=5, cast=int)
+AUTH_USER_CACHE_TIMEOUT = config('AUTH_USER_CACHE_TIMEOUT', default=300, cast=int)
+
 
 # logs 
 # settings.py
@@ -12,7 +12,8 @@ class UserAdmin(admin.ModelAdmin):
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ('id','parent__name','name', 'slug')
+    list_display = ('id','parent__name','name', 'slug', 'depth')
+    readonly_fields = ('path', 'depth')
 
 
 @admin.register(Product)
@@ -21,11 +22,24 @@ class ProductAdmin(admin.ModelAdmin):
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
-    list_display = ('id', 'buyer', 'created_at')
+    list_display = ('id', 'buyer', 'created_at', 'total_items', 'total_cost')
+    list_select_related = ('buyer',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_totals()
+
+    @admin.display(description='total items', ordering='annotated_total_items')
+    def total_items(self, cart):
+        return cart.annotated_total_items
+
+    @admin.display(description='total cost', ordering='annotated_total_cost')
+    def total_cost(self, cart):
+        return cart.annotated_total_cost
 
 @admin.register(CartItem)
 class CartItemAdmin(admin.ModelAdmin):
     list_display = ('id', 'cart', 'product', 'quantity','total_cost')
+    list_select_related = ('cart__buyer', 'product__category', 'product__seller')
 
 @admin.register(Address)
 class AddressAdmin(admin.ModelAdmin):
@@ -34,14 +48,27 @@ class AddressAdmin(admin.ModelAdmin):
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('id', 'buyer', 'billing_address','shipping_address', 'created_at', 'status','total_cost')
+    list_select_related = ('buyer', 'billing_address', 'shipping_address')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_totals()
+
+    @admin.display(description='total cost', ordering='annotated_total_cost')
+    def total_cost(self, order):
+        return order.annotated_total_cost
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
     list_display = ('id', 'order', 'product', 'quantity', 'cost')
+    list_select_related = ('order__buyer', 'product__category', 'product__seller')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_cost()
 
 @admin.register(Review)
 class ReviewAdmin(admin.ModelAdmin):
-    list_display = ('id', 'product', 'user', 'rating', 'review_text', 'created_at')
+    list_display = ('id', 'product', 'user', 'rating', 'helpful_count', 'review_text', 'created_at')
+    list_select_related = ('product__category', 'product__seller', 'user')
 
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
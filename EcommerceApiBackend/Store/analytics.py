@@ -0,0 +1,189 @@
+'''
+Seller analytics from daily rollups.
+
+``rollup_daily_stats`` (run by the ``rollup_seller_stats`` command, e.g. every few minutes) keeps one
+``ProductDailyStats`` row per product and day, and one ``SellerDailyStats`` row of distinct orders per seller and day. It is incremental: only the days of orders created or updated
+since the previous run are recomputed from the order tables, and the views a product got since the previous run
+(``views - views_counted``, read through a partial index of the products with such views) are added to today's rows. The dashboard queries below read the rollup rows of one seller only, at most one per product-day.
+Revenue is the quantity times the price of the product when it was ordered, cancelled orders are left out.
+'''
+from datetime import timedelta
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ValidationError
+from .models import Order, OrderItem, Product, ProductDailyStats, SellerDailyStats, RollupCheckpoint, order_line_total
+
+ROLLUP_NAME = 'product_daily_stats'
+# orders committed late with an earlier updated_at are picked up by the next run, recomputing a day is idempotent
+ROLLUP_OVERLAP = timedelta(minutes=5)
+DAYS_PER_BATCH = 31
+DEFAULT_RANGE_DAYS = 30
+MAX_RANGE_DAYS = 366
+TOP_PRODUCTS_LIMIT = 10
+METRICS = ('revenue', 'units', 'orders', 'views')
+
+
+def rollup_daily_stats(now=None, full=False):
+    '''Bring the daily stats up to date, returns ``(days recomputed, products with new views)``'''
+    now = now or timezone.now()
+    with transaction.atomic():
+        checkpoint, created = RollupCheckpoint.objects.select_for_update().get_or_create(name=ROLLUP_NAME)
+        orders = Order.objects.order_by()
+        if checkpoint.position is not None and not full:
+            orders = orders.filter(updated_at__gte=checkpoint.position)
+        days = sorted(set(orders.annotate(day=TruncDate('created_at')).values_list('day', flat=True).distinct()))
+        if full:
+            sync_counted_views()
+        for i in range(0, len(days), DAYS_PER_BATCH):
+            rollup_sales(days[i:i + DAYS_PER_BATCH])
+        viewed = rollup_views(timezone.localdate(now))
+        checkpoint.position = now - ROLLUP_OVERLAP
+        checkpoint.save(update_fields=['position'])
+    return len(days), viewed
+
+
+def rollup_sales(days):
+    '''Recompute units, revenue and orders of every product and the orders of every seller on ``days`` from the order items'''
+    ProductDailyStats.objects.filter(date__in=days).update(units=0, revenue=0, orders=0)
+    SellerDailyStats.objects.filter(date__in=days).update(orders=0)
+    items = (
+        OrderItem.objects.filter(order__created_at__date__in=days).exclude(order__status='cancelled')
+        .annotate(day=TruncDate('order__created_at'))
+    )
+    rows = (
+        items.values('product_id', 'product__seller_id', 'day')
+        .annotate(units=Sum('quantity'), revenue=Sum(order_line_total()), orders=Count('order_id', distinct=True))
+        .order_by()
+    )
+    stats = [
+        ProductDailyStats(product_id=row['product_id'], seller_id=row['product__seller_id'], date=row['day'],
+                          units=row['units'], revenue=row['revenue'], orders=row['orders'])
+        for row in rows
+    ]
+    ProductDailyStats.objects.bulk_create(
+        stats, batch_size=1000, update_conflicts=True,
+        unique_fields=['product', 'date'], update_fields=['seller', 'units', 'revenue', 'orders'],
+    )
+    seller_rows = items.values('product__seller_id', 'day').annotate(orders=Count('order_id', distinct=True)).order_by()
+    SellerDailyStats.objects.bulk_create(
+        [SellerDailyStats(seller_id=row['product__seller_id'], date=row['day'], orders=row['orders']) for row in seller_rows],
+        batch_size=1000, update_conflicts=True, unique_fields=['seller', 'date'], update_fields=['orders'],
+    )
+
+
+def sync_counted_views():
+    '''Set ``views_counted`` of every product to the views of its daily rows, e.g. after adding the column'''
+    counted = ProductDailyStats.objects.filter(product=OuterRef('pk')).order_by().values('product').annotate(total=Sum('views')).values('total')
+    Product.objects.update(views_counted=Coalesce(Subquery(counted), Value(0)))
+
+
+def rollup_views(day, batch_size=500):
+    '''Add the views of every product not counted in any daily row yet to its row of ``day``'''
+    viewed, last_id = 0, 0
+    while True:
+        batch = list(pending_views().filter(id__gt=last_id).order_by('id')[:batch_size])
+        if not batch:
+            return viewed
+        viewed += _add_views(day, batch)
+        last_id = batch[-1][0]
+
+
+def pending_views():
+    '''``(id, seller_id, views, views_counted)`` of the products with views not counted yet'''
+    return Product.objects.filter(views__gt=F('views_counted')).values_list('id', 'seller_id', 'views', 'views_counted')
+
+
+def _add_views(day, rows):
+    today = dict(ProductDailyStats.objects.filter(date=day, product_id__in=[row[0] for row in rows]).values_list('product_id', 'views'))
+    stats = [
+        ProductDailyStats(product_id=product_id, seller_id=seller_id, date=day, views=today.get(product_id, 0) + views - counted)
+        for product_id, seller_id, views, counted in rows
+    ]
+    ProductDailyStats.objects.bulk_create(
+        stats, update_conflicts=True, unique_fields=['product', 'date'], update_fields=['seller', 'views'],
+    )
+    # views added meanwhile stay above the value read and are counted by the next run
+    Product.objects.bulk_update([Product(pk=product_id, views_counted=views) for product_id, seller_id, views, counted in rows], ['views_counted'])
+    return len(stats)
+
+
+def parse_date_range(params):
+    '''``(start, end)`` of the ``start`` / ``end`` query parameters, both included, the last 30 days by default'''
+    try:
+        end = parse_date(params['end']) if params.get('end') else timezone.localdate()
+        start = parse_date(params['start']) if params.get('start') else end - timedelta(days=DEFAULT_RANGE_DAYS - 1)
+    except ValueError:
+        start = end = None
+    if start is None or end is None:
+        raise ValidationError({'date': _('Dates must be formatted as YYYY-MM-DD.')})
+    if start > end:
+        raise ValidationError({'date': _('start must not be after end.')})
+    if (end - start).days >= MAX_RANGE_DAYS:
+        raise ValidationError({'date': _('The date range can be at most %(days)s days.') % {'days': MAX_RANGE_DAYS}})
+    return start, end
+
+
+def metric_totals(orders=True):
+    '''Sums of the daily product rows, without ``orders`` for totals over several products (see seller_orders)'''
+    totals = {
+        'revenue': Coalesce(Sum('revenue'), Value(Decimal('0.00'))),
+        'units': Coalesce(Sum('units'), Value(0)),
+        'orders': Coalesce(Sum('orders'), Value(0)),
+        'views': Coalesce(Sum('views'), Value(0)),
+    }
+    if not orders:
+        del totals['orders']
+    return totals
+
+
+def format_metrics(row):
+    '''Metrics of a row with the views-to-order conversion rate (``None`` without views)'''
+    metrics = {
+        'revenue': str(Decimal(row['revenue']).quantize(Decimal('0.01'))),
+        'units': row['units'],
+        'orders': row['orders'],
+        'views': row['views'],
+    }
+    metrics['conversion'] = round(row['orders'] / row['views'], 4) if row['views'] else None
+    return metrics
+
+
+def seller_stats(seller, start, end):
+    return ProductDailyStats.objects.filter(seller=seller, date__range=(start, end)).order_by()
+
+
+def seller_orders(seller, start, end):
+    '''Distinct orders of the seller, an order of several of their products counts once'''
+    return SellerDailyStats.objects.filter(seller=seller, date__range=(start, end)).order_by()
+
+
+def seller_summary(seller, start, end):
+    totals = seller_stats(seller, start, end).aggregate(**metric_totals(orders=False))
+    totals['orders'] = seller_orders(seller, start, end).aggregate(orders=Coalesce(Sum('orders'), Value(0)))['orders']
+    return {'start': start, 'end': end, **format_metrics(totals)}
+
+
+def seller_daily(seller, start, end):
+    '''One entry per day of the range, days without sales or views included'''
+    rows = {row['date']: row for row in seller_stats(seller, start, end).values('date').annotate(**metric_totals(orders=False))}
+    orders = dict(seller_orders(seller, start, end).values_list('date', 'orders'))
+    empty = {'revenue': 0, 'units': 0, 'views': 0}
+    return [
+        {'date': day, **format_metrics({**rows.get(day, empty), 'orders': orders.get(day, 0)})}
+        for day in (start + timedelta(days=i) for i in range((end - start).days + 1))
+    ]
+
+
+def seller_top_products(seller, start, end, sort='revenue', limit=TOP_PRODUCTS_LIMIT):
+    if sort not in METRICS:
+        raise ValidationError({'sort': _('Choose one of %(choices)s.') % {'choices': ', '.join(METRICS)}})
+    rows = (
+        seller_stats(seller, start, end).values('product_id', 'product__name').annotate(**metric_totals())
+        .order_by(f'-{sort}', 'product_id')[:limit]
+    )
+    return [{'product': row['product_id'], 'name': row['product__name'], **format_metrics(row)} for row in rows]
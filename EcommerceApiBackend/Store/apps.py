@@ -1,6 +1,11 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class StoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Store'
+
+    def ready(self):
+        from . import signals  # register signal handlers
+        post_migrate.connect(signals.setup_search, sender=self)
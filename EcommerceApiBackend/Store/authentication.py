@@ -0,0 +1,173 @@
+'''
+JWT authentication without database reads on the hot path.
+
+``CachedJWTAuthentication`` resolves the user of a token from a per process cache (a few seconds) backed by the
+shared Django cache (a few minutes), both dropped whenever the user is saved or deleted (see Store/signals.py),
+so a deactivated user is locked out within ``AUTH_USER_LOCAL_TIMEOUT`` seconds on every process. Only the fields
+of AUTH_USER_FIELDS are cached, never the password hash, other fields are loaded from the database on access.
+
+Blacklisted token ids are kept in an in-memory set per process. It is reloaded from the blacklist table only when
+the shared blacklist version changes, i.e. after a logout anywhere, so checking a token costs one cache read.
+Logging out blacklists the access token too, not just the refresh token.
+
+Both rely on invalidations reaching every process. Without a shared cache (``SHARED_CACHE`` off, e.g. the per
+process memory cache of development) users are only kept for the few seconds of the local cache and the
+blacklist is read from the database on every check.
+'''
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router, transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch, get_md5_hash_password
+from .caching import get_version, bump_version
+
+AUTH_BLACKLIST_VERSION_KEY = 'auth:blacklist:version'
+LOCAL_USER_CACHE_SIZE = 10000
+# what authentication and the permissions read from request.user
+AUTH_USER_FIELDS = ('id', 'username', 'email', 'first_name', 'last_name', 'is_active', 'is_staff', 'is_superuser', 'is_seller')
+
+
+def shared_cache():
+    '''Whether every process reads the same cache, so invalidations made by one reach all of them'''
+    return getattr(settings, 'SHARED_CACHE', False)
+
+
+def auth_user_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+class UserCache:
+    '''Users by primary key, per process for AUTH_USER_LOCAL_TIMEOUT seconds, shared for AUTH_USER_CACHE_TIMEOUT.'''
+    def __init__(self):
+        self._local = {}
+
+    @property
+    def local_timeout(self):
+        return getattr(settings, 'AUTH_USER_LOCAL_TIMEOUT', 5)
+
+    @property
+    def shared_timeout(self):
+        return getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 60 * 5)
+
+    def get(self, user_model, user_id):
+        '''
+        A new instance of the user with the AUTH_USER_FIELDS loaded and the other fields deferred,
+        ``None`` if it does not exist
+        '''
+        # from_db takes the values in the order of the model fields
+        fields = [field.attname for field in user_model._meta.concrete_fields if field.attname in AUTH_USER_FIELDS]
+        entry = self._local.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            values = entry[1]
+        else:
+            values = cache.get(auth_user_key(user_id)) if shared_cache() else None
+            if values is None:
+                values = user_model.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).values_list(*fields).first()
+                if values is None:
+                    return None
+                if shared_cache():
+                    cache.set(auth_user_key(user_id), values, self.shared_timeout)
+            if len(self._local) >= LOCAL_USER_CACHE_SIZE:
+                self._local.clear()
+            self._local[user_id] = (time.monotonic() + self.local_timeout, values)
+        return user_model.from_db(router.db_for_read(user_model), fields, values)
+
+    def clear(self):
+        self._local.clear()
+
+    def invalidate(self, *user_ids):
+        for user_id in user_ids:
+            self._local.pop(user_id, None)
+        keys = [auth_user_key(user_id) for user_id in user_ids]
+        cache.delete_many(keys)
+        # a concurrent request may cache the old row before the change commits, drop it again afterwards
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+class TokenBlacklist:
+    '''In-memory set of the blacklisted (and not yet expired) token ids, synced through the shared cache version'''
+    def __init__(self):
+        self._jtis = set()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, jti):
+        if not shared_cache():
+            # the version bumped by a logout in another process would never show up here
+            return BlacklistedToken.objects.filter(token__jti=jti).exists()
+        version = get_version(AUTH_BLACKLIST_VERSION_KEY)
+        if version != self._version:
+            self._load(version)
+        return jti in self._jtis
+
+    def _load(self, version):
+        jtis = set(
+            BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now()).values_list('token__jti', flat=True)
+        )
+        with self._lock:
+            self._jtis, self._version = jtis, version
+
+    def add(self, jti):
+        '''Record a blacklisted id here at once, and in the other processes once the blacklisting commits'''
+        with self._lock:
+            self._jtis.add(jti)
+        transaction.on_commit(lambda: bump_version(AUTH_BLACKLIST_VERSION_KEY))
+
+
+user_cache = UserCache()
+token_blacklist = TokenBlacklist()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    '''``JWTAuthentication`` reading users and the token blacklist from memory / the cache'''
+    def get_validated_token(self, raw_token):
+        validated_token = super().get_validated_token(raw_token)
+        if validated_token.get(api_settings.JTI_CLAIM) in token_blacklist:
+            raise InvalidToken({'detail': _('Token is blacklisted'), 'code': 'token_not_valid'})
+        return validated_token
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        user = user_cache.get(self.user_model, user_id)
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # the password hash is not cached, reading it loads it from the database
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        return user
+
+
+class CachedRefreshToken(RefreshToken):
+    '''Refresh token checked against the in-memory blacklist instead of the blacklist table'''
+    def check_blacklist(self):
+        if self.payload[api_settings.JTI_CLAIM] in token_blacklist:
+            raise TokenError(_('Token is blacklisted'))
+
+
+class CachedTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = CachedRefreshToken
+
+
+def blacklist_token(token):
+    '''Blacklist any token (access tokens have no ``blacklist()`` of their own)'''
+    outstanding, created = OutstandingToken.objects.get_or_create(
+        jti=token[api_settings.JTI_CLAIM],
+        defaults={'token': str(token), 'expires_at': datetime_from_epoch(token['exp'])},
+    )
+    return BlacklistedToken.objects.get_or_create(token=outstanding)
@@ -0,0 +1,139 @@
+'''
+Bulk import and export of a seller's products as CSV or NDJSON (one JSON object per line).
+
+Neither direction holds the catalog in memory: an upload is decoded and parsed line by line, every row is
+validated against the category names of one cached lookup and the valid rows are inserted ``IMPORT_BATCH_SIZE``
+at a time with ``bulk_create``, each batch in its own transaction together with its search and specification
+index rows. Invalid rows are skipped and reported by line. An export streams the rows of a server side
+iterator straight into the response. The columns of both are IMPORT_FIELDS, so an export can be imported again.
+'''
+import codecs
+import csv
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ValidationError
+from .models import Product, ProductSpecAttribute
+from .caching import get_category_ids, invalidate_catalog_products
+from .search import get_search_backend
+from .serializers import ProductImportSerializer
+
+FILE_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+FILE_EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+IMPORT_FIELDS = ('name', 'description', 'price', 'stock', 'category', 'author', 'specification')
+EXPORT_FIELDS = ('id', *IMPORT_FIELDS)
+IMPORT_BATCH_SIZE = 500
+EXPORT_CHUNK_SIZE = 2000
+# the report lists the first errors only, the number of failed rows is always complete
+MAX_REPORTED_ERRORS = 1000
+
+
+def parse_file_format(value, filename=''):
+    '''``csv`` or ``ndjson``, given explicitly or guessed from the extension of ``filename``'''
+    if not value:
+        extension = filename[filename.rfind('.'):].lower() if '.' in filename else ''
+        value = FILE_EXTENSIONS.get(extension)
+    if value not in FILE_FORMATS:
+        raise ValidationError({'file_format': _('Choose one of %(choices)s.') % {'choices': ', '.join(FILE_FORMATS)}})
+    return value
+
+
+def read_rows(file, file_format):
+    '''``(line, row, error)`` of every record of an uploaded file, read incrementally'''
+    lines = codecs.iterdecode(file, 'utf-8-sig')
+    try:
+        if file_format == 'csv':
+            reader = csv.DictReader(lines)
+            for row in reader:
+                row.pop(None, None)  # values beyond the header columns
+                yield reader.line_num, row, None
+        else:
+            for number, line in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    yield number, None, {'non_field_errors': [_('Invalid JSON.')]}
+                    continue
+                if isinstance(row, dict):
+                    yield number, row, None
+                else:
+                    yield number, None, {'non_field_errors': [_('Expected a JSON object.')]}
+    except (csv.Error, UnicodeDecodeError) as error:
+        # the rest of the file can not be read reliably
+        yield None, None, {'file': [str(error)]}
+
+
+def insert_products(products):
+    '''Insert one batch of products with their search and specification index rows'''
+    with transaction.atomic():
+        ids = [product.pk for product in Product.objects.bulk_create(products)]
+        inserted = Product.objects.filter(pk__in=ids)
+        get_search_backend().index_products(inserted)
+        ProductSpecAttribute.objects.index_products(inserted)
+    return len(ids)
+
+
+def import_products(file, file_format, seller, batch_size=IMPORT_BATCH_SIZE):
+    '''Create the valid rows of ``file`` as products of ``seller``, returns ``{created, failed, errors}``'''
+    context = {'categories': get_category_ids()}
+    report = {'created': 0, 'failed': 0, 'errors': []}
+    batch = []
+    for line, row, errors in read_rows(file, file_format):
+        if errors is None:
+            serializer = ProductImportSerializer(data=row, context=context)
+            if serializer.is_valid():
+                batch.append(Product(seller=seller, **serializer.validated_data))
+            else:
+                errors = serializer.errors
+        if errors is not None:
+            report['failed'] += 1
+            if len(report['errors']) < MAX_REPORTED_ERRORS:
+                report['errors'].append({'line': line, 'errors': errors})
+        if len(batch) >= batch_size:
+            report['created'] += insert_products(batch)
+            batch = []
+    if batch:
+        report['created'] += insert_products(batch)
+    if report['created']:
+        invalidate_catalog_products()
+    return report
+
+
+class Echo:
+    '''File-like object handing back what is written, lets ``csv.writer`` produce lines for streaming'''
+    def write(self, value):
+        return value
+
+
+def export_lines(queryset, file_format, chunk_size=EXPORT_CHUNK_SIZE):
+    '''Lines of the products of ``queryset``, joined into one string per ``chunk_size`` rows'''
+    rows = queryset.order_by('id').values_list('id', *[
+        'category__name' if field == 'category' else field for field in IMPORT_FIELDS
+    ])
+    if file_format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(EXPORT_FIELDS)
+        format_row = lambda row: writer.writerow([
+            json.dumps(value) if field == 'specification' and value is not None else value
+            for field, value in zip(EXPORT_FIELDS, row)
+        ])
+    else:
+        format_row = lambda row: json.dumps(dict(zip(EXPORT_FIELDS, row)), cls=DjangoJSONEncoder) + '\n'
+    lines = []
+    for row in rows.iterator(chunk_size=chunk_size):
+        lines.append(format_row(row))
+        if len(lines) >= chunk_size:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+def export_response(queryset, file_format):
+    response = StreamingHttpResponse(export_lines(queryset, file_format), content_type=FILE_FORMATS[file_format])
+    response['Content-Disposition'] = f'attachment; filename="products.{file_format}"'
+    return response
@@ -0,0 +1,213 @@
+'''
+Cache keys and helpers shared by the Store views and signals.
+'''
+import hashlib
+import json
+import time
+from uuid import uuid4
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.cache import patch_cache_control
+from django.utils.http import quote_etag, parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+from .models import Category
+
+CATEGORY_TREE_VERSION_KEY = 'category_tree:version'
+CATEGORY_TREE_TIMEOUT = 60 * 60 * 24
+# nested product data (stock, views) changed with bulk updates is refreshed at least this often
+CART_CACHE_TIMEOUT = 60 * 5
+CART_CACHE_VIEWS = ('detail', 'items')
+# public catalog responses are fresh for CATALOG_FRESH_TIMEOUT seconds, then served stale while one request
+# rebuilds them for up to CATALOG_STALE_TIMEOUT more seconds
+CATALOG_FRESH_TIMEOUT = 60
+CATALOG_STALE_TIMEOUT = 60 * 5
+CATALOG_REBUILD_LOCK_TIMEOUT = 30
+CATALOG_LIST_VERSION_KEY = 'catalog:list:version'
+CATALOG_CATEGORY_VERSION_KEY = 'catalog:category:version'
+
+
+def get_version(key):
+    """Current version token stored under ``key``, created on first use."""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(*keys):
+    """
+    Replace the version tokens, every cache entry built with the old ones is outdated. Bumped now and again
+    once the current transaction commits, so an entry rebuilt from the data before the commit is outdated too.
+    """
+    if keys:
+        cache.set_many({key: uuid4().hex for key in keys}, None)
+        transaction.on_commit(lambda: cache.set_many({key: uuid4().hex for key in keys}, None))
+
+
+def get_category_tree_version():
+    """Current version token of the category tree, created on first use."""
+    return get_version(CATEGORY_TREE_VERSION_KEY)
+
+
+def bump_category_tree_version():
+    """Invalidate every cached copy of the category tree."""
+    bump_version(CATEGORY_TREE_VERSION_KEY)
+
+
+def get_category_index():
+    '''
+    Map of normalized category name to the ids of the category and all its subcategories,
+    built from one query and cached until the category tree changes.
+    '''
+    key = f'category_index:{get_category_tree_version()}'
+    index = cache.get(key)
+    if index is None:
+        rows = list(Category.objects.values_list('id', 'name', 'path'))
+        subtree = {pk: [] for pk, _, _ in rows}
+        for pk, _, path in rows:
+            for ancestor in path.split(Category.PATH_SEPARATOR):
+                if ancestor and int(ancestor) in subtree:
+                    subtree[int(ancestor)].append(pk)
+        index = {normalize_category_name(name): subtree[pk] or [pk] for pk, name, _ in rows}
+        cache.set(key, index, CATEGORY_TREE_TIMEOUT)
+    return index
+
+
+def get_category_ids():
+    '''Map of lower cased category name to category id, cached until the category tree changes.'''
+    key = f'category_ids:{get_category_tree_version()}'
+    ids = cache.get(key)
+    if ids is None:
+        ids = {name.lower(): pk for pk, name in Category.objects.values_list('id', 'name')}
+        cache.set(key, ids, CATEGORY_TREE_TIMEOUT)
+    return ids
+
+
+def normalize_category_name(name):
+    """Lower case words without plural ``s`` so "Book", "books" and "BOOKS" share one key."""
+    return ' '.join(word[:-1] if len(word) > 3 and word.endswith('s') else word for word in name.lower().split())
+
+
+def get_category_tree(version):
+    """Nested category tree for the given version, built once and then served from cache."""
+    key = f'category_tree:{version}'
+    tree = cache.get(key)
+    if tree is None:
+        tree = Category.objects.get_tree()
+        cache.set(key, tree, CATEGORY_TREE_TIMEOUT)
+    return tree
+
+
+def cart_cache_key(user_id, view):
+    return f'cart:{user_id}:{view}'
+
+
+def get_cached_cart(user_id, view, build):
+    """Serialized cart data of a user, ``build()`` computes it on a cache miss."""
+    key = cart_cache_key(user_id, view)
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, CART_CACHE_TIMEOUT)
+    return data
+
+
+def invalidate_cart_cache(*user_ids):
+    """
+    Drop the cached carts of the users, now and again once the current transaction commits
+    so a read racing with the transaction can not put stale data back.
+    """
+    keys = [cart_cache_key(user_id, view) for user_id in user_ids for view in CART_CACHE_VIEWS]
+    if keys:
+        cache.delete_many(keys)
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def product_version_key(product_id):
+    return f'catalog:product:{product_id}:version'
+
+
+def get_catalog_list_version():
+    return get_version(CATALOG_LIST_VERSION_KEY)
+
+
+def get_catalog_detail_version(product_id):
+    """Version of a product detail, changes with the product and with any category."""
+    return f'{get_version(product_version_key(product_id))}:{get_version(CATALOG_CATEGORY_VERSION_KEY)}'
+
+
+def invalidate_catalog_products(*product_ids):
+    """Outdate the listings and the details of the given products."""
+    bump_version(CATALOG_LIST_VERSION_KEY, *[product_version_key(pk) for pk in product_ids])
+
+
+def review_feed_version_key(product_id):
+    return f'catalog:product:{product_id}:reviews:version'
+
+
+def get_review_feed_version(product_id):
+    return get_version(review_feed_version_key(product_id))
+
+
+def invalidate_review_feeds(*product_ids):
+    """Outdate the cached review feeds of the given products."""
+    bump_version(*[review_feed_version_key(pk) for pk in product_ids])
+
+
+def invalidate_catalog_categories():
+    """Category names show up in every product, outdate the whole catalog."""
+    bump_version(CATALOG_LIST_VERSION_KEY, CATALOG_CATEGORY_VERSION_KEY)
+
+
+def get_cached_catalog_data(key, version, build):
+    """``build()`` cached under ``key`` until the catalog ``version`` changes."""
+    return cache.get_or_set(f'{key}:{version}', build, CATALOG_FRESH_TIMEOUT + CATALOG_STALE_TIMEOUT)
+
+
+def catalog_cache_key(kind, request, params):
+    """
+    Key of a catalog response for the normalized ``params`` (known parameters only, sorted, trimmed),
+    so ``?b=1&a=2`` and ``?a=2&b=1&utm_source=x`` share one entry.
+    """
+    normalized = sorted(
+        (name, sorted(value.strip().lower() if name == 'search' else value.strip() for value in request.query_params.getlist(name)))
+        for name in params if name in request.query_params
+    )
+    signature = json.dumps([request.get_host(), normalized])
+    return f'catalog:{kind}:{hashlib.md5(signature.encode()).hexdigest()}'
+
+
+def cached_catalog_response(request, key, version, build):
+    """
+    Response of ``build()`` cached under ``key`` with stale-while-revalidate: an outdated (expired or older
+    ``version``) entry is served as is while the single request that wins the rebuild lock refreshes it,
+    so a burst after an expiry or a change costs one rebuild. Sends ETag / Cache-Control and answers
+    ``If-None-Match`` with 304.
+    """
+    entry = cache.get(key)
+    now = time.time()
+    fresh = entry is not None and entry['version'] == version and entry['fresh_until'] > now
+    if not fresh:
+        lock_key = f'{key}:lock'
+        locked = cache.add(lock_key, 1, CATALOG_REBUILD_LOCK_TIMEOUT)
+        if locked or entry is None:
+            try:
+                data = build()
+                etag = hashlib.md5(json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True).encode()).hexdigest()
+                entry = {'version': version, 'fresh_until': now + CATALOG_FRESH_TIMEOUT, 'data': data, 'etag': etag}
+                cache.set(key, entry, CATALOG_FRESH_TIMEOUT + CATALOG_STALE_TIMEOUT)
+            finally:
+                if locked:
+                    cache.delete(lock_key)
+
+    etag = quote_etag(entry['etag'])
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(entry['data'])
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=CATALOG_FRESH_TIMEOUT, stale_while_revalidate=CATALOG_STALE_TIMEOUT)
+    return response
@@ -0,0 +1,55 @@
+'''
+Conversion of a buyer's cart into an order.
+
+Everything happens in one transaction with a fixed number of queries whatever the cart size: the cart row is
+locked so a double submit can not order it twice, stock is reserved for all lines at once (see Store/stock.py),
+the cart lines are copied into order items with a single ``INSERT ... SELECT`` and the cart is emptied.
+'''
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
+from .models import Cart, CartItem, Order, OrderItem, Product
+from .stock import reserve_stock, order_quantities, reservation_deadline
+from .caching import invalidate_cart_cache
+
+
+def copy_cart_items(cart, order):
+    '''Copy every line of ``cart`` into ``order`` at the current prices inside the database, returns the number of lines copied.'''
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {qn(OrderItem._meta.db_table)} ({qn("order_id")}, {qn("product_id")}, {qn("quantity")}, {qn("price")}) '
+            f'SELECT %s, c.{qn("product_id")}, c.{qn("quantity")}, p.{qn("price")} '
+            f'FROM {qn(CartItem._meta.db_table)} c JOIN {qn(Product._meta.db_table)} p ON p.{qn("id")} = c.{qn("product_id")} '
+            f'WHERE c.{qn("cart_id")} = %s ORDER BY c.{qn("id")}',
+            [order.pk, cart.pk],
+        )
+        return cursor.rowcount
+
+
+def checkout_cart(user, shipping_address, billing_address):
+    '''Turn the cart of ``user`` into a pending order holding the stock of its items and empty the cart.'''
+    with transaction.atomic():
+        cart = Cart.objects.select_for_update().filter(buyer=user).first()
+        if cart is None:
+            raise NotFound(_('Cart not found.'))
+        lines = list(cart.cart_items.order_by('id').values_list('product_id', 'quantity', 'product__seller_id', 'product__price'))
+        if not lines:
+            raise ValidationError({'cart': _('Cart is empty.')})
+        if any(seller_id == user.pk for product_id, quantity, seller_id, price in lines):
+            raise PermissionDenied(_('Adding your own product to your order is not allowed'))
+
+        reserve_stock(order_quantities((product_id, quantity) for product_id, quantity, seller_id, price in lines))
+        order = Order.objects.create(
+            buyer=user,
+            shipping_address=shipping_address,
+            billing_address=billing_address,
+            reserved_until=reservation_deadline(),
+            **Order.summarize((product_id, quantity, price) for product_id, quantity, seller_id, price in lines),
+        )
+        copy_cart_items(cart, order)
+        cart.cart_items.all().delete()  # a single DELETE, the cart cache is invalidated once below
+        Cart.objects.filter(pk=cart.pk).update(status='ordered', updated_at=timezone.now())
+        invalidate_cart_cache(user.pk)
+    return order
@@ -0,0 +1,84 @@
+'''
+Buffered product view counting.
+
+Views are added up in memory and written in batches with ``UPDATE ... SET views = views + n``, so a page view
+costs no write, concurrent increments are never lost and ``updated_at`` is left alone. A daemon thread flushes
+the buffer every ``PRODUCT_VIEWS_FLUSH_INTERVAL`` seconds and once more when the process exits gracefully.
+With an interval of 0 every increment is written immediately.
+'''
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+
+class ProductViewBuffer:
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'PRODUCT_VIEWS_FLUSH_INTERVAL', 10)
+
+    def increment(self, product_id, count=1):
+        with self._lock:
+            self._counts[product_id] += count
+        if self.flush_interval <= 0:
+            self.flush()
+        else:
+            self._ensure_thread()
+
+    def pending(self, product_id):
+        '''Views of the product not written to the database yet'''
+        with self._lock:
+            return self._counts.get(product_id, 0)
+
+    def flush(self):
+        '''Write the buffered views, one UPDATE per distinct increment. Returns the number of products updated.'''
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        if not counts:
+            return 0
+        by_increment = defaultdict(list)
+        for product_id, count in counts.items():
+            by_increment[count].append(product_id)
+        try:
+            for count, product_ids in by_increment.items():
+                Product.objects.filter(id__in=product_ids).update(views=F('views') + count)
+        except Exception:
+            # keep the counts for the next flush instead of losing them
+            with self._lock:
+                self._counts.update(counts)
+            raise
+        return len(counts)
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='product-view-flusher', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing product views failed')
+            finally:
+                close_old_connections()
+
+
+product_views = ProductViewBuffer()
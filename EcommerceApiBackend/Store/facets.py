@@ -0,0 +1,77 @@
+'''
+Facet counts of the product listing (``?facets=category,price,stock,author``).
+
+All requested facets are computed by one grouped aggregate query over the filtered listing: the query groups
+by the facets that need a row per value (category, author) and counts the price buckets and the stock with
+conditional aggregates, the per facet totals are then summed up from those rows.
+'''
+from django.db.models import Count, Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ValidationError
+
+FACETS = ('category', 'price', 'stock', 'author')
+# lower bound included, upper bound excluded, in Rs
+PRICE_BUCKETS = ((0, 500), (500, 1000), (1000, 5000), (5000, 20000), (20000, None))
+AUTHOR_FACET_SIZE = 20
+
+
+def parse_facets(value):
+    '''Facet names of a comma separated ``facets`` parameter, in the order of FACETS'''
+    names = {name.strip().lower() for name in value.split(',') if name.strip()}
+    unknown = names.difference(FACETS)
+    if unknown:
+        raise ValidationError({'facets': _('Unknown facets: %(names)s, choose from %(choices)s.') % {
+            'names': ', '.join(sorted(unknown)), 'choices': ', '.join(FACETS)}})
+    return [name for name in FACETS if name in names]
+
+
+def price_bucket_filter(low, high):
+    condition = Q(price__gte=low)
+    if high is not None:
+        condition &= Q(price__lt=high)
+    return condition
+
+
+def compute_facets(queryset, names):
+    '''``{facet: counts}`` of the products in ``queryset`` for the facet ``names``'''
+    group_by = []
+    if 'category' in names:
+        group_by += ['category_id', 'category__name']
+    if 'author' in names:
+        group_by.append('author')
+    aggregates = {'count': Count('id')}
+    if 'price' in names:
+        for i, (low, high) in enumerate(PRICE_BUCKETS):
+            aggregates[f'price_{i}'] = Count('id', filter=price_bucket_filter(low, high))
+    if 'stock' in names:
+        aggregates['in_stock'] = Count('id', filter=Q(stock__gt=0))
+
+    queryset = queryset.order_by()
+    rows = list(queryset.values(*group_by).annotate(**aggregates)) if group_by else [queryset.aggregate(**aggregates)]
+
+    facets = {}
+    if 'category' in names:
+        categories = {}
+        for row in rows:
+            category = categories.setdefault(row['category_id'], {'id': row['category_id'], 'name': row['category__name'], 'count': 0})
+            category['count'] += row['count']
+        facets['category'] = sorted(categories.values(), key=lambda category: (-category['count'], category['name']))
+    if 'price' in names:
+        facets['price'] = [
+            {'min': low, 'max': high, 'count': sum(row[f'price_{i}'] for row in rows)}
+            for i, (low, high) in enumerate(PRICE_BUCKETS)
+        ]
+    if 'stock' in names:
+        in_stock = sum(row['in_stock'] for row in rows)
+        facets['stock'] = {'in_stock': in_stock, 'out_of_stock': sum(row['count'] for row in rows) - in_stock}
+    if 'author' in names:
+        # only books have an author
+        authors = {}
+        for row in rows:
+            if row['author']:
+                authors[row['author']] = authors.get(row['author'], 0) + row['count']
+        facets['author'] = [
+            {'name': author, 'count': count}
+            for author, count in sorted(authors.items(), key=lambda item: (-item[1], item[0]))[:AUTHOR_FACET_SIZE]
+        ]
+    return facets
@@ -1,42 +1,233 @@
+import re
+from decimal import Decimal
 import django_filters
-from rest_framework.filters import SearchFilter
+from rest_framework.filters import SearchFilter, OrderingFilter
+from django.db import connection
 from django.db.models import Q
-from .models import Product
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ValidationError
+from .models import Category, Product, ProductSpecAttribute, spec_value_text
+from .search import SEARCH_RANK, search_products
+from .caching import get_category_index, normalize_category_name
+
+SPEC_PARAM_PREFIX = 'spec.'
+SPEC_KEY_RE = re.compile(r'^[\w\- ]{1,100}$')
+
+
+def spec_params(query_params):
+    '''``spec.<key>`` parameters of a request, ``{key: [values]}``'''
+    specs = {}
+    for name in query_params:
+        if name.startswith(SPEC_PARAM_PREFIX):
+            key = name[len(SPEC_PARAM_PREFIX):]
+            if not SPEC_KEY_RE.match(key):
+                raise ValidationError({name: _('Invalid specification attribute.')})
+            values = [value.strip() for value in query_params.getlist(name) if value.strip()]
+            if values:
+                specs[key] = values
+    return specs
+
+
+def spec_json_values(text):
+    '''JSON values a spec filter value matches, "16" matches both 16 and "16", "true" matches true'''
+    values = [text]
+    normalized = spec_value_text(text)
+    if normalized != text:
+        values.append(normalized)
+    if normalized in ('true', 'false'):
+        values.append(normalized == 'true')
+    else:
+        try:
+            number = float(normalized)
+            values.append(int(number) if number.is_integer() else number)
+        except ValueError:
+            pass
+    return values
+
+
+def filter_specification(queryset, specs):
+    '''
+    Products whose specification has every ``key`` set to one of its values (or a list containing one).
+    PostgreSQL answers ``specification @> {...}`` from the GIN index, other databases use the attribute table.
+    '''
+    for key, texts in specs.items():
+        if connection.vendor == 'postgresql':
+            match = Q()
+            for value in (value for text in texts for value in spec_json_values(text)):
+                match |= Q(specification__contains={key: value}) | Q(specification__contains={key: [value]})
+            queryset = queryset.filter(match)
+        else:
+            values = {spec_value_text(text) for text in texts}
+            queryset = queryset.filter(id__in=ProductSpecAttribute.objects.filter(key=key, value__in=values).values('product_id'))
+    return queryset
+
 
 class ProductFilter(django_filters.FilterSet):
-    '''Custom product filter class'''
-    category = django_filters.CharFilter(field_name='category__name', lookup_expr='iexact')
+    '''Custom product filter class, also filters on ``spec.<key>=<value>`` specification attributes'''
+    category = django_filters.CharFilter(method='filter_category')
     min_price = django_filters.NumberFilter(field_name='price', lookup_expr='gte')
     max_price = django_filters.NumberFilter(field_name='price', lookup_expr='lte')
+    min_rating = django_filters.NumberFilter(field_name='rating_avg', lookup_expr='gte')
 
     class Meta:
         model = Product
-        fields = ['category','min_price','max_price']
+        fields = ['category','min_price','max_price','min_rating']
+
+    def filter_queryset(self, queryset):
+        return filter_specification(super().filter_queryset(queryset), spec_params(self.data))
+
+    def filter_category(self, queryset, name, value):
+        '''Category name resolved up front, so sorted listings seek the (category, ordering) indexes instead of a join'''
+        ids = list(Category.objects.filter(name__iexact=value).values_list('pk', flat=True))
+        if len(ids) == 1:
+            return queryset.filter(category_id=ids[0])
+        return queryset.filter(category_id__in=ids)
+
+
+class ProductSearchQuery:
+    '''
+    Parsed form of a free form product search such as "harry potter books by rowling under 1k".
+
+    Understands price ranges ("between 500 and 1000", "500-1000", "under 1k", "above 2.5k", "from 100 to 300"),
+    category names (multi word names too, singular or plural) looked up in the cached category index,
+    "by <author>" and free text. Anything that is not understood is kept as free text, never an error.
+    '''
+    MAX_PRICE_WORDS = ('under', 'below', 'upto', 'within', 'max', 'less', 'cheaper', 'lower', 'till')
+    MIN_PRICE_WORDS = ('above', 'over', 'min', 'more', 'atleast', 'costlier', 'higher', 'starting')
+    RANGE_WORDS = ('between', 'from')
+    FILLER_WORDS = {'than', 'rs', 'inr', 'price', 'priced', 'the', 'a', 'an', 'of', 'for', 'in', 'with', 'and', 'to',
+                    'least', 'by', 'between', 'from'}
+    NUMBER_RE = re.compile(r'^(?:rs\.?|₹)?(\d+(?:\.\d+)?)(k|l|lakh|lac)?$')
+    RANGE_RE = re.compile(r'^(?:rs\.?|₹)?(\d+(?:\.\d+)?k?)-(?:rs\.?|₹)?(\d+(?:\.\d+)?k?)$')
+    MULTIPLIERS = {None: 1, 'k': 1000, 'l': 100000, 'lakh': 100000, 'lac': 100000}
+
+    def __init__(self, text, category_index):
+        self.min_price = None
+        self.max_price = None
+        self.category_ids = None
+        self.category_name = None
+        self.author_terms = []
+        self.text_terms = []
+        self.category_index = category_index
+        self.parse(text.lower().replace(',', '').split())
+
+    @classmethod
+    def parse_number(cls, token):
+        match = cls.NUMBER_RE.match(token)
+        if match is None:
+            return None
+        return Decimal(match.group(1)) * cls.MULTIPLIERS[match.group(2)]
+
+    def parse(self, tokens):
+        category_index = self.category_index
+        longest_category = max((len(name.split()) for name in category_index), default=0)
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if token in self.RANGE_WORDS:
+                low = self.next_number(tokens, i + 1)
+                high = self.next_number(tokens, low[1] + 1) if low[0] is not None else (None, i)
+                if high[0] is not None:
+                    self.min_price, self.max_price = sorted((low[0], high[0]))
+                    i = high[1] + 1
+                    continue
+            elif token in self.MAX_PRICE_WORDS or token in self.MIN_PRICE_WORDS:
+                price, end = self.next_number(tokens, i + 1)
+                if price is not None:
+                    if token in self.MAX_PRICE_WORDS:
+                        self.max_price = price
+                    else:
+                        self.min_price = price
+                    i = end + 1
+                    continue
+            elif token == 'by' and i + 1 < len(tokens):
+                # author name runs until the next keyword or category
+                i += 1
+                while i < len(tokens) and not self.is_keyword(tokens[i]):
+                    self.author_terms.append(tokens[i])
+                    i += 1
+                continue
+            elif self.RANGE_RE.match(token):
+                low, high = self.RANGE_RE.match(token).groups()
+                self.min_price, self.max_price = sorted((self.parse_number(low), self.parse_number(high)))
+                i += 1
+                continue
+
+            if self.category_ids is None:
+                # longest run of words naming a category wins, "mobile phones" before "phones"
+                for size in range(min(longest_category, len(tokens) - i), 0, -1):
+                    name = normalize_category_name(' '.join(tokens[i:i + size]))
+                    if name in category_index:
+                        self.category_name, self.category_ids = name, category_index[name]
+                        i += size
+                        break
+                else:
+                    size = 0
+                if size:
+                    continue
+            if token not in self.FILLER_WORDS:
+                self.text_terms.append(token)
+            i += 1
+
+    def next_number(self, tokens, start):
+        '''First price after ``start`` skipping filler words such as "than" or "rs", returns ``(price, position)``.'''
+        i = start
+        while i < len(tokens) and tokens[i] in self.FILLER_WORDS:
+            i += 1
+        if i < len(tokens):
+            price = self.parse_number(tokens[i])
+            if price is not None:
+                return price, i
+        return None, start
+
+    def is_keyword(self, token):
+        return (token in self.MAX_PRICE_WORDS or token in self.MIN_PRICE_WORDS or token in self.FILLER_WORDS
+                or normalize_category_name(token) in self.category_index)
+
+    def filter(self, queryset):
+        '''All parsed conditions compiled into a single query.'''
+        conditions = {}
+        if self.min_price is not None:
+            conditions['price__gte'] = self.min_price
+        if self.max_price is not None:
+            conditions['price__lte'] = self.max_price
+        if self.category_ids is not None:
+            conditions['category_id__in'] = self.category_ids
+        return search_products(queryset.filter(**conditions), self.text_terms, self.author_terms)
 
 
 class CustomSearchFilter(SearchFilter):
+    '''Search products with queries like "phones under 10k", "books by rowling" or "laptop between 50k and 80k"'''
     def get_search_terms(self, request):
-        # Override to allow searching for queries like "under 1000"
-        query = request.query_params.get(self.search_param, '').lower().strip()
-        terms = query.split()
-        return terms
+        return request.query_params.get(self.search_param, '').strip()
 
     def filter_queryset(self, request, queryset, view):
-        search_terms = self.get_search_terms(request)
-        category = None
-
-        if "under" in search_terms:
-            price=int(search_terms[search_terms.index('under')+1])
-            queryset = queryset.filter(price__lte=price)
-            print(queryset)
-            category = search_terms[search_terms.index('under')-1]
-        elif "above" in search_terms:
-            price=int(search_terms[search_terms.index('above')+1])
-            queryset = queryset.filter(price__gte=price)
-            print(queryset)
-            category = search_terms[search_terms.index('above')-1]
-        
-        if category is not None :
-            queryset = queryset.filter(category__name__icontains=category)  # Filter products by category name``
-        
-        return queryset
\ No newline at end of file
+        search = self.get_search_terms(request)
+        if not search:
+            return queryset
+        return ProductSearchQuery(search, get_category_index()).filter(queryset)
+
+
+class ProductOrderingFilter(OrderingFilter):
+    '''
+    Order search results by relevance unless an ordering is requested explicitly.
+    Besides field names (``?ordering=-price``) the named sorts of ORDERING_ALIASES are accepted (``?ordering=top_rated``).
+    '''
+    ORDERING_ALIASES = {
+        'price_asc': 'price',
+        'price_desc': '-price',
+        'newest': '-created_at',
+        'most_viewed': '-views',
+        'top_rated': '-rating_avg',
+    }
+
+    def get_ordering(self, request, queryset, view):
+        params = request.query_params.get(self.ordering_param)
+        if params:
+            fields = [self.ORDERING_ALIASES.get(param.strip(), param.strip()) for param in params.split(',')]
+            ordering = self.remove_invalid_fields(queryset, fields, view, request)
+            if ordering:
+                return ordering
+        elif SEARCH_RANK in queryset.query.annotations:
+            return ['-' + SEARCH_RANK]
+        return self.get_default_ordering(view)
\ No newline at end of file
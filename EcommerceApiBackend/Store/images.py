@@ -0,0 +1,130 @@
+'''
+Resized and WebP variants of uploaded images.
+
+When a product or profile image changes, the variants of IMAGE_VARIANTS are rendered in a background thread pool
+once the upload transaction commits, so the request returns immediately. They are stored next to the original
+(``product_images/variants/<name>_<variant>.<ext>``) and their names recorded in the ``*_variants`` field of the
+row, which serializers turn into URLs. Until the variants exist the serializers only return the original.
+With ``IMAGE_PROCESSING_WORKERS = 0`` images are processed in the request (tests, management commands).
+'''
+import logging
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# longest side in pixels, images are never upscaled
+IMAGE_VARIANTS = {'thumbnail': 200, 'medium': 600, 'large': 1200}
+IMAGE_FORMATS = {'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+                 'webp': ('WEBP', {'quality': 80, 'method': 4})}
+
+
+def variant_name(name, variant, extension):
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, 'variants', f'{stem}_{variant}.{extension}')
+
+
+def render_variants(field_file):
+    '''Render every variant of ``field_file`` into its storage, returns ``{variant: {format: name}}``'''
+    storage = field_file.storage
+    with field_file.open('rb') as source:
+        original = ImageOps.exif_transpose(Image.open(source))
+        original.load()
+    has_alpha = original.mode in ('RGBA', 'LA') or (original.mode == 'P' and 'transparency' in original.info)
+    variants = {}
+    for variant, size in IMAGE_VARIANTS.items():
+        image = original.copy()
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        variants[variant] = {}
+        for extension, (image_format, options) in IMAGE_FORMATS.items():
+            if image_format == 'JPEG':
+                rendered = image.convert('RGB')
+            else:
+                rendered = image.convert('RGBA' if has_alpha else 'RGB')
+            buffer = BytesIO()
+            rendered.save(buffer, image_format, **options)
+            name = variant_name(field_file.name, variant, extension)
+            if storage.exists(name):
+                storage.delete(name)
+            variants[variant][extension] = storage.save(name, ContentFile(buffer.getvalue()))
+    return variants
+
+
+class ImagePipeline:
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def workers(self):
+        return getattr(settings, 'IMAGE_PROCESSING_WORKERS', 2)
+
+    def schedule(self, instance, field_name, variants_field, on_done=None):
+        '''
+        Render the variants of ``instance.<field_name>`` after the current transaction commits, unless they
+        are up to date or the field holds its default image. ``on_done(pk)`` runs once the variants are saved.
+        '''
+        if not self.needs_variants(instance, field_name, variants_field):
+            return
+        job = (instance._meta.label, instance.pk, field_name, variants_field, getattr(instance, field_name).name, on_done)
+        transaction.on_commit(lambda: self.submit(*job))
+
+    @staticmethod
+    def needs_variants(instance, field_name, variants_field):
+        '''Whether the image is an upload whose variants were not rendered yet'''
+        field_file = getattr(instance, field_name)
+        if not field_file or field_file.name == instance._meta.get_field(field_name).default:
+            return False
+        return getattr(instance, variants_field).get('source') != field_file.name
+
+    def submit(self, *job):
+        if self.workers <= 0:
+            return self.process(*job)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='image-variants')
+        self._executor.submit(self._run, *job)
+
+    def _run(self, *job):
+        try:
+            self.process(*job)
+        except Exception:
+            logger.exception('Rendering image variants of %s %s failed', job[0], job[1])
+        finally:
+            close_old_connections()
+
+    def process(self, label, pk, field_name, variants_field, source, on_done=None):
+        '''Render the variants of ``source`` and record them, unless the image was replaced meanwhile'''
+        model = apps.get_model(label)
+        instance = model.objects.filter(pk=pk, **{field_name: source}).only('pk', field_name).first()
+        if instance is None:
+            return
+        variants = render_variants(getattr(instance, field_name))
+        updated = model.objects.filter(pk=pk, **{field_name: source}).update(**{variants_field: {'source': source, **variants}})
+        if updated and on_done is not None:
+            on_done(pk)
+
+
+def variant_urls(variants, request=None):
+    '''``{variant: {format: url}}`` of a ``*_variants`` field value, empty until the variants are rendered'''
+    urls = {}
+    for variant in IMAGE_VARIANTS:
+        names = variants.get(variant)
+        if names:
+            urls[variant] = {
+                extension: request.build_absolute_uri(default_storage.url(name)) if request else default_storage.url(name)
+                for extension, name in names.items()
+            }
+    return urls
+
+
+image_pipeline = ImagePipeline()
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Min, Sum
+from Store.models import CartItem
+
+
+class Command(BaseCommand):
+    help = 'Merge cart lines of the same product into one, run before adding the unique cart/product constraint'
+
+    def handle(self, *args, **options):
+        duplicates = (
+            CartItem.objects.values('cart', 'product')
+            .annotate(lines=Count('id'), keep=Min('id'), total=Sum('quantity'))
+            .filter(lines__gt=1)
+        )
+        merged = 0
+        with transaction.atomic():
+            for duplicate in duplicates:
+                CartItem.objects.filter(pk=duplicate['keep']).update(quantity=duplicate['total'])
+                CartItem.objects.filter(cart=duplicate['cart'], product=duplicate['product']).exclude(pk=duplicate['keep']).delete()
+                merged += 1
+        self.stdout.write(self.style.SUCCESS(f'{merged} duplicated cart lines merged'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from Store.models import Category
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized path and depth of every product category'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = Category.objects.rebuild_tree()
+        self.stdout.write(self.style.SUCCESS(f'Category tree rebuilt, {updated} categories updated'))
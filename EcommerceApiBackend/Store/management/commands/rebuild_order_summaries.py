@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from Store.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Recompute the item count, total and first product shown in the order history of every order'
+
+    def handle(self, *args, **options):
+        updated = Order.objects.all().refresh_summaries()
+        self.stdout.write(self.style.SUCCESS(f'Order summaries rebuilt, {updated} orders updated'))
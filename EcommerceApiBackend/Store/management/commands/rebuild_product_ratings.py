@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from Store.models import Product
+from Store.caching import invalidate_catalog_categories
+
+
+class Command(BaseCommand):
+    help = 'Recompute the rating average, count and histogram of every product from its reviews'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = Product.objects.rebuild_ratings()
+        if updated:
+            invalidate_catalog_categories()  # outdates every cached product at once
+        self.stdout.write(self.style.SUCCESS(f'Product ratings rebuilt, {updated} products updated'))
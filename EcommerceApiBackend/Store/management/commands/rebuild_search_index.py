@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from Store.models import Product
+from Store.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full text search index of every product'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.setup()
+        backend.index_products(Product.objects.all())
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt with {backend.__class__.__name__}'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from Store.models import Product, ProductSpecAttribute
+from Store.caching import invalidate_catalog_categories
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the specification attribute index of every product'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            written = ProductSpecAttribute.objects.index_products(Product.objects.all())
+        invalidate_catalog_categories()  # outdates every cached listing and attribute list
+        self.stdout.write(self.style.SUCCESS(f'Specification index rebuilt, {written} attributes indexed'))
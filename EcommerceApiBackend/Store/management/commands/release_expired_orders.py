@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from Store.stock import release_expired_orders
+
+
+class Command(BaseCommand):
+    help = 'Cancel pending orders whose stock reservation expired and put their items back in stock'
+
+    def handle(self, *args, **options):
+        cancelled = release_expired_orders()
+        self.stdout.write(self.style.SUCCESS(f'{cancelled} expired orders cancelled'))
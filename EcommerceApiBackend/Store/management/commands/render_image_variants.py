@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from Store.models import Product, User
+from Store.images import image_pipeline
+from Store.signals import refresh_product_image_caches
+
+
+class Command(BaseCommand):
+    help = 'Render the missing resized and WebP variants of product and profile images'
+
+    def handle(self, *args, **options):
+        rendered = 0
+        jobs = [
+            (Product, 'img', 'img_variants', refresh_product_image_caches),
+            (User, 'profile_img', 'profile_img_variants', None),
+        ]
+        for model, field_name, variants_field, on_done in jobs:
+            for instance in model.objects.only('pk', field_name, variants_field).iterator(chunk_size=500):
+                if image_pipeline.needs_variants(instance, field_name, variants_field):
+                    source = getattr(instance, field_name).name
+                    image_pipeline.process(model._meta.label, instance.pk, field_name, variants_field, source, on_done)
+                    rendered += 1
+        self.stdout.write(self.style.SUCCESS(f'Image variants rendered for {rendered} images'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from Store.analytics import rollup_daily_stats
+
+
+class Command(BaseCommand):
+    help = 'Roll up the orders and views since the previous run into the daily seller analytics'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every day instead of the changed ones')
+
+    def handle(self, *args, **options):
+        days, viewed = rollup_daily_stats(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f'Seller stats rolled up, {days} days recomputed, views of {viewed} products added'))
@@ -1,12 +1,24 @@
+from collections import Counter, defaultdict
+from decimal import Decimal, ROUND_HALF_UP
 from typing import Iterable
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q, Value, Sum, Count, Case, When, DecimalField, ExpressionWrapper, FloatField, OuterRef, Subquery
+from django.db.models.functions import Cast, Concat, Substr, Coalesce, Round
+from django.core.exceptions import ValidationError
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import RegexValidator,MinValueValidator,MaxValueValidator
+from django.utils import timezone
 from django.utils.text import slugify
 from django.utils.functional import cached_property
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 # Create your models here.
 
 
+USES_POSTGRES = settings.DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql'
+
+
 class User(AbstractUser):
     phone_number = models.CharField(
         max_length=10,
@@ -21,15 +33,66 @@ class User(AbstractUser):
     email = models.EmailField(unique=True)
     is_seller = models.BooleanField(default=False)
     profile_img=models.ImageField(upload_to='UserProfileImages/',default='defaultProfileimg.png')
+    profile_img_variants = models.JSONField(default=dict, blank=True, editable=False)  # rendered by Store/images.py
+
+
+class CategoryManager(models.Manager):
+    def rebuild_tree(self):
+        """
+        Recompute ``path`` and ``depth`` of every category from the parent links.
+        Used to backfill existing data, returns number of categories updated.
+        """
+        nodes = {pk: parent_id for pk, parent_id in self.values_list('id', 'parent_id')}
+        paths = {}
+
+        def resolve(pk):
+            if pk not in paths:
+                parent_id = nodes[pk]
+                prefix = resolve(parent_id) if parent_id is not None else ''
+                paths[pk] = f'{prefix}{pk}{Category.PATH_SEPARATOR}'
+            return paths[pk]
+
+        categories = list(self.only('id', 'path', 'depth'))
+        changed = []
+        for category in categories:
+            path = resolve(category.id)
+            depth = path.count(Category.PATH_SEPARATOR) - 1
+            if category.path != path or category.depth != depth:
+                category.path, category.depth = path, depth
+                changed.append(category)
+        self.bulk_update(changed, ['path', 'depth'], batch_size=500)
+        return len(changed)
+
+    def get_tree(self):
+        """
+        Whole category tree as nested dicts built from a single query.
+        Parents always come before their children when ordered by depth.
+        """
+        nodes = {}
+        roots = []
+        rows = self.order_by('depth', 'name').values('id', 'name', 'slug', 'description', 'parent_id')
+        for row in rows:
+            node = {**row, 'subcategories': []}
+            nodes[row['id']] = node
+            parent = nodes.get(row['parent_id'])
+            (parent['subcategories'] if parent is not None else roots).append(node)
+        return roots
 
 
 class Category(models.Model):
+    PATH_SEPARATOR = '/'
+
     name = models.CharField(max_length=255, unique=True)
     slug = models.SlugField(max_length=255, unique=True, blank=True)
     parent = models.ForeignKey(
         'self', on_delete=models.CASCADE, null=True, blank=True, related_name='subcategories'
     )
     description = models.TextField(blank=True, null=True)
+    # materialized path of ids from the root down to this category, e.g. "1/4/9/"
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='')
+    depth = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CategoryManager()
 
     class Meta:
         verbose_name='product category'
@@ -39,8 +102,33 @@ class Category(models.Model):
         # Automatically generate slug from name if not provided
         if not self.slug:
             self.slug = slugify(self.name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'parent' not in update_fields:
+            return super().save(*args, **kwargs)
+
+        old_path = None
+        if self.pk is not None:
+            old_path = Category.objects.filter(pk=self.pk).values_list('path', flat=True).first()
+        parent_path = ''
+        if self.parent_id is not None:
+            parent_path = Category.objects.values_list('path', flat=True).get(pk=self.parent_id)
+            if old_path and parent_path.startswith(old_path):
+                raise ValidationError({'parent': 'A category can not be moved under itself or its subcategories.'})
         super().save(*args, **kwargs)
 
+        new_path = f'{parent_path}{self.pk}{self.PATH_SEPARATOR}'
+        if new_path == old_path:
+            return
+        new_depth = new_path.count(self.PATH_SEPARATOR) - 1
+        if old_path:
+            # moved: rewrite the path prefix of the whole subtree in one statement
+            Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (new_depth - old_path.count(self.PATH_SEPARATOR) + 1),
+            )
+        Category.objects.filter(pk=self.pk).update(path=new_path, depth=new_depth)
+        self.path, self.depth = new_path, new_depth
+
     def __str__(self):
         return self.name
 
@@ -52,21 +140,95 @@ class Category(models.Model):
     @property
     def get_all_products(self):
         """Return products from this category and all of its subcategories."""
-        subcategory_ids = self.get_descendants()
-        return Product.objects.filter(category__in=subcategory_ids)
-
-    def get_descendants(self):
-        """Get all subcategories including self."""
-        subcategories = [self.id]
-        for subcategory in self.subcategories.all():
-            subcategories.extend(subcategory.get_descendants())
-        return subcategories
+        return Product.objects.filter(category__path__startswith=self.path)
+
+    def get_descendants(self, include_self=True):
+        """Get all subcategories (including self by default) in one query."""
+        descendants = Category.objects.filter(path__startswith=self.path)
+        if not include_self:
+            descendants = descendants.exclude(pk=self.pk)
+        return descendants
+
+    def get_ancestor_ids(self, include_self=False):
+        """Ids of the ancestors from the root down, read from the path without a query."""
+        ids = [int(pk) for pk in self.path.split(self.PATH_SEPARATOR) if pk]
+        return ids if include_self else ids[:-1]
+
+    def get_ancestors(self, include_self=False):
+        """Get all parent categories ordered from the root down."""
+        return Category.objects.filter(id__in=self.get_ancestor_ids(include_self)).order_by('depth')
+
+    def get_breadcrumbs(self):
+        """Root-to-self list of ``{id, name, slug}`` used for navigation."""
+        return list(self.get_ancestors(include_self=True).values('id', 'name', 'slug'))
     
 
+RATINGS = range(1, 6)
+
+
+def rating_count_field(rating):
+    return f'rating_{rating}_count'
+
+
+class ProductQuerySet(models.QuerySet):
+    def apply_rating_change(self, added=None, removed=None):
+        """
+        Add the review rating ``added`` and/or take out ``removed`` from the rating aggregates of the products,
+        in a single UPDATE computing the new average from the stored histogram so concurrent reviews never
+        overwrite each other. Returns the number of products updated.
+        """
+        deltas = Counter()
+        if added is not None:
+            deltas[added] += 1
+        if removed is not None:
+            deltas[removed] -= 1
+        deltas = {rating: delta for rating, delta in deltas.items() if delta}
+        if not deltas:
+            return 0
+        count_delta = sum(deltas.values())
+        sum_delta = sum(rating * delta for rating, delta in deltas.items())
+        # every right hand side of the UPDATE reads the row as it was before the update
+        weighted_sum = sum((F(rating_count_field(rating)) * rating for rating in RATINGS), Value(sum_delta))
+        average = Case(
+            When(rating_count=-count_delta, then=Value(Decimal('0.00'))),
+            default=Round(
+                Cast(weighted_sum, FloatField()) / (F('rating_count') + count_delta), 2,
+                output_field=DecimalField(max_digits=3, decimal_places=2),
+            ),
+        )
+        updates = {rating_count_field(rating): F(rating_count_field(rating)) + delta for rating, delta in deltas.items()}
+        return self.update(rating_avg=average, rating_count=F('rating_count') + count_delta, **updates)
+
+    def rebuild_ratings(self, batch_size=1000):
+        """
+        Recompute the rating aggregates of the products from their reviews.
+        Used to backfill existing data, returns number of products updated.
+        """
+        histograms = defaultdict(Counter)
+        for product_id, rating, count in (
+            Review.objects.filter(product__in=self).values_list('product', 'rating').annotate(count=Count('id')).order_by()
+        ):
+            histograms[product_id][rating] = count
+
+        fields = ['rating_avg', 'rating_count', *(rating_count_field(rating) for rating in RATINGS)]
+        changed, updated = [], 0
+        for product in self.only('id', *fields).order_by().iterator(chunk_size=batch_size):
+            histogram = histograms.get(product.pk, Counter())
+            if product.set_ratings(histogram):
+                changed.append(product)
+            if len(changed) >= batch_size:
+                updated += self.model.objects.bulk_update(changed, fields)
+                changed = []
+        if changed:
+            updated += self.model.objects.bulk_update(changed, fields)
+        return updated
+
+
 # do it later about currency of price
 class Product(models.Model):
     name            = models.CharField( max_length=255)
     img             = models.ImageField(upload_to='product_images/', default='defaultProduct.png')
+    img_variants    = models.JSONField(default=dict, blank=True, editable=False)  # rendered by Store/images.py
     seller          = models.ForeignKey(User,on_delete=models.CASCADE)
     category        = models.ForeignKey(Category,related_name='products',on_delete=models.CASCADE)
     description     = models.TextField(help_text='Product description')
@@ -75,9 +237,39 @@ class Product(models.Model):
     price           = models.DecimalField(max_digits=10,decimal_places=2)  # here price unit is  Rs
     stock           = models.PositiveIntegerField()
     views           = models.IntegerField(default=0)
+    views_counted   = models.IntegerField(default=0, editable=False)  # views already in the daily stats, see Store/analytics.py
     quantity        = models.IntegerField(default=1)
     created_at      = models.DateTimeField( auto_now_add=True)
     updated_at      = models.DateTimeField( auto_now=True)
+    search_vector   = SearchVectorField(null=True, editable=False)  # maintained by Store/search.py on PostgreSQL
+    # rating aggregates of the reviews, maintained by Review.save / the review delete signal
+    rating_avg      = models.DecimalField(max_digits=3, decimal_places=2, default=0, editable=False)
+    rating_count    = models.PositiveIntegerField(default=0, editable=False)
+    rating_1_count  = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count  = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count  = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count  = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count  = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # keyset pagination of the product listing, see Store/pagination.py
+            models.Index(fields=['created_at', 'id'], name='product_created_id_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['rating_avg', 'id'], name='product_rating_id_idx'),
+            models.Index(fields=['views', 'id'], name='product_views_id_idx'),
+            # sorted listings of a category
+            models.Index(fields=['category', 'price', 'id'], name='product_category_price_idx'),
+            models.Index(fields=['category', 'created_at', 'id'], name='product_category_created_idx'),
+            # products with views the seller analytics rollup has not counted yet
+            models.Index(fields=['id'], condition=Q(views__gt=F('views_counted')), name='product_views_pending_idx'),
+        ]
+        if USES_POSTGRES:
+            indexes.append(GinIndex(fields=['search_vector'], name='product_search_vector_idx'))
+            # ``specification @> {...}`` lookups of the spec filters, see Store/filters.py
+            indexes.append(GinIndex(fields=['specification'], opclasses=['jsonb_path_ops'], name='product_spec_gin_idx'))
 
     def __str__(self):
         return f"{self.name} of category {self.category.name} and seller {self.seller.get_full_name}"
@@ -85,8 +277,122 @@ class Product(models.Model):
     def is_in_stock(self):
         return self.stock > 0
 
+    @property
+    def rating_histogram(self):
+        """Number of reviews per star rating, ``{1: n, ..., 5: n}``."""
+        return {rating: getattr(self, rating_count_field(rating)) for rating in RATINGS}
+
+    def set_ratings(self, histogram):
+        """Set the rating aggregates from a ``{rating: count}`` histogram, returns whether anything changed."""
+        count = sum(histogram.values())
+        total = sum(rating * n for rating, n in histogram.items())
+        average = (Decimal(total) / count).quantize(Decimal('0.01'), ROUND_HALF_UP) if count else Decimal('0.00')
+        values = {'rating_avg': average, 'rating_count': count}
+        values.update({rating_count_field(rating): histogram.get(rating, 0) for rating in RATINGS})
+        changed = any(getattr(self, name) != value for name, value in values.items())
+        for name, value in values.items():
+            setattr(self, name, value)
+        return changed
+
     
 
+def spec_value_text(value):
+    """Text form of a scalar specification value, numbers normalized so 16, 16.0 and "16" compare equal."""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return str(int(value)) if float(value).is_integer() else str(value)
+    if isinstance(value, str):
+        value = value.strip()
+        try:
+            return spec_value_text(float(value)) if value else value
+        except ValueError:
+            return value
+    return None
+
+
+class ProductSpecAttributeManager(models.Manager):
+    def index_products(self, products, batch_size=1000):
+        """
+        Rewrite the attribute rows of ``products`` (a queryset) from their ``specification``,
+        top level scalar values and scalar list items only. Returns number of rows written.
+        """
+        written = 0
+        ids, rows = [], []
+        for product_id, specification in products.values_list('id', 'specification').iterator(chunk_size=batch_size):
+            ids.append(product_id)
+            if isinstance(specification, dict):
+                for key, value in specification.items():
+                    values = value if isinstance(value, list) else [value]
+                    texts = {spec_value_text(item) for item in values} - {None, ''}
+                    rows += [self.model(product_id=product_id, key=str(key)[:100], value=text[:255]) for text in texts]
+            if len(ids) >= batch_size:
+                written += self._replace(ids, rows)
+                ids, rows = [], []
+        if ids:
+            written += self._replace(ids, rows)
+        return written
+
+    def _replace(self, product_ids, rows):
+        self.filter(product_id__in=product_ids).delete()  # no signals or relations, a single DELETE
+        self.bulk_create(rows, batch_size=1000)
+        return len(rows)
+
+
+class ProductSpecAttribute(models.Model):
+    """
+    One ``key = value`` pair of a product specification. Serves the attribute discovery of a category and
+    the spec filters on databases without an indexable JSON containment (sqlite).
+    """
+    product = models.ForeignKey(Product, related_name='spec_attributes', on_delete=models.CASCADE)
+    key     = models.CharField(max_length=100)
+    value   = models.CharField(max_length=255)
+
+    objects = ProductSpecAttributeManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['key', 'value', 'product'], name='spec_key_value_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} = {self.value}"
+
+
+def line_total(prefix=''):
+    """SQL expression of ``quantity * product.price`` for cart or order item rows."""
+    return ExpressionWrapper(
+        F(f'{prefix}quantity') * F(f'{prefix}product__price'),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+def order_line_price(prefix=''):
+    """Unit price of order item rows when they were ordered, the current product price for rows from before that."""
+    return Coalesce(F(f'{prefix}price'), F(f'{prefix}product__price'))
+
+
+def order_line_total(prefix=''):
+    """SQL expression of ``quantity * price`` for order item rows, priced when ordered."""
+    return ExpressionWrapper(
+        F(f'{prefix}quantity') * order_line_price(prefix),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+def sum_line_totals(prefix, total=line_total):
+    return Coalesce(Sum(total(prefix)), Value(0), output_field=DecimalField(max_digits=12, decimal_places=2))
+
+
+class CartQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Annotate number of items and total cost of each cart, computed by the database."""
+        return self.annotate(
+            annotated_total_items=Count('cart_items'),
+            annotated_total_cost=sum_line_totals('cart_items__'),
+        )
+
+
 class Cart(models.Model):
     buyer=models.OneToOneField(User,related_name='cart',on_delete=models.CASCADE)
     created_at=models.DateTimeField(auto_now_add=True)
@@ -97,7 +403,11 @@ class Cart(models.Model):
         default='active'
     )
 
+    objects = CartQuerySet.as_manager()
+
     def total_cost(self):
+        if hasattr(self, 'annotated_total_cost'):
+            return self.annotated_total_cost
         return sum(item.total_cost for item in self.cart_items.all())
     
     def __str__(self):
@@ -109,6 +419,12 @@ class CartItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            # one line per product, adding it again increases the quantity (see merge_cart_duplicates for old data)
+            models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product'),
+        ]
+
     @property
     def total_cost(self):
         effective_price = self.product.price
@@ -138,6 +454,32 @@ class Address(models.Model):
         return super().save(*args, **kwargs)
 
 
+class OrderQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Annotate number of items and total cost of each order, computed by the database."""
+        return self.annotate(
+            annotated_total_items=Count('order_items'),
+            annotated_total_cost=sum_line_totals('order_items__', order_line_total),
+        )
+
+    def refresh_summaries(self):
+        """
+        Recompute the denormalized item count, total and first product of the orders from their items,
+        every line at the price it was ordered at, so changing one item does not re-price the others.
+        ``updated_at`` is touched so the next analytics rollup recomputes the day of the orders.
+        """
+        items = OrderItem.objects.filter(order=OuterRef('pk')).order_by()
+        return self.update(
+            item_count=Coalesce(Subquery(items.values('order').annotate(n=Count('id')).values('n')), Value(0)),
+            total_amount=Coalesce(
+                Subquery(items.values('order').annotate(total=Sum(order_line_total())).values('total')),
+                Value(Decimal('0.00')), output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+            first_product=Subquery(items.order_by('id').values('product_id')[:1]),
+            updated_at=timezone.now(),
+        )
+
+
 class Order(models.Model):
     buyer                = models.ForeignKey(User, on_delete=models.CASCADE)
     shipping_address     = models.ForeignKey(Address,related_name='shipping_orders', on_delete=models.SET_NULL, null=True)
@@ -146,29 +488,72 @@ class Order(models.Model):
     updated_at           = models.DateTimeField(auto_now=True)
     status               = models.CharField(
         max_length=20, 
-        choices=[('pending', 'Pending'), ('shipped', 'Shipped'), ('delivered', 'Delivered')],
+        choices=[('pending', 'Pending'), ('shipped', 'Shipped'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled')],
         default='pending'
     )
+    reserved_until       = models.DateTimeField(null=True, blank=True)  # stock of a pending order is held until then
+    # summary of the items for the order history, written with the items (see OrderQuerySet.refresh_summaries)
+    item_count           = models.PositiveIntegerField(default=0, editable=False)
+    total_amount         = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    first_product        = models.ForeignKey(Product, related_name='+', on_delete=models.SET_NULL, null=True, blank=True, editable=False)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['buyer', 'created_at', 'id'], name='order_buyer_created_id_idx'),
+            models.Index(fields=['status', 'reserved_until'], name='order_reservation_idx'),
+        ]
 
     @property
     def total_cost(self):
-        return sum(i.total_cost for i in  self.order_items.all())
+        if hasattr(self, 'annotated_total_cost'):
+            return self.annotated_total_cost
+        return sum(i.cost for i in  self.order_items.all())
+
+    @staticmethod
+    def summarize(lines):
+        """Summary fields of an order made of ``(product_id, quantity, price)`` lines, in line order."""
+        lines = list(lines)
+        total = sum((quantity * price for product_id, quantity, price in lines), Decimal('0.00'))
+        return {
+            'item_count': len(lines),
+            'total_amount': total.quantize(Decimal('0.01')),
+            'first_product_id': lines[0][0] if lines else None,
+        }
 
     def __str__(self) -> str:
         return f"Order {self.id} - {self.buyer.username}"
 
     
+class OrderItemQuerySet(models.QuerySet):
+    def with_cost(self):
+        """Annotate unit price and cost of each item so the product row is not needed."""
+        return self.annotate(unit_price=order_line_price(), line_cost=order_line_total())
+
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='order_items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
+    # unit price when ordered, set on save (bulk writers set it themselves), null on rows from before the column
+    price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
+
+    objects = OrderItemQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        if self.price is None:
+            self.price = self.product.price
+        super().save(*args, **kwargs)
 
     @cached_property
     def cost(self):
         """
         Total cost of the ordered item
         """
-        return round(self.quantity * self.product.price, 2)
+        if hasattr(self, 'line_cost'):
+            return round(self.line_cost, 2)
+        return round(self.quantity * (self.price if self.price is not None else self.product.price), 2)
 
     def __str__(self):
         return f"{self.quantity} of {self.product.name}"
@@ -201,10 +586,111 @@ class Review(models.Model):
     product     = models.ForeignKey(Product, on_delete=models.CASCADE)
     rating      = models.PositiveIntegerField(choices=[(i,str(i)) for i in range(1,6)] ,validators=[MinValueValidator(1), MaxValueValidator(5)])
     review_text = models.TextField(null=True, blank=True)
+    helpful_count = models.PositiveIntegerField(default=0, editable=False)  # number of ReviewVote rows
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ('product', 'user')  # Ensure one review per user per product
+        indexes = [
+            # review feed of a product, newest or most helpful first, see ReviewViewSet
+            models.Index(fields=['product', 'created_at', 'id'], name='review_product_created_id_idx'),
+            models.Index(fields=['product', 'helpful_count', 'id'], name='review_product_helpful_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} - {self.user.username} ({self.rating} stars)"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._rated = (instance.__dict__.get('product_id'), instance.__dict__.get('rating'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        # the rating aggregates of the product are updated in the same transaction as the review
+        with transaction.atomic():
+            previous = None if self._state.adding else self.get_saved_rating()
+            super().save(*args, **kwargs)
+            self.update_product_ratings(previous)
+
+    def get_saved_rating(self):
+        """``(product_id, rating)`` of the review as last read from or written to the database."""
+        rated = getattr(self, '_rated', None)
+        if rated is None or None in rated:
+            rated = Review.objects.filter(pk=self.pk).values_list('product_id', 'rating').first()
+        return rated
+
+    def update_product_ratings(self, previous):
+        """Move the rating of the review in the product aggregates from ``previous`` to its current value."""
+        if previous is None:
+            Product.objects.filter(pk=self.product_id).apply_rating_change(added=self.rating)
+        elif previous[0] != self.product_id:
+            Product.objects.filter(pk=previous[0]).apply_rating_change(removed=previous[1])
+            Product.objects.filter(pk=self.product_id).apply_rating_change(added=self.rating)
+        else:
+            Product.objects.filter(pk=self.product_id).apply_rating_change(added=self.rating, removed=previous[1])
+        self._rated = (self.product_id, self.rating)
+
+class ReviewVote(models.Model):
+    """A user finding a review helpful, at most once per review."""
+    review     = models.ForeignKey(Review, related_name='votes', on_delete=models.CASCADE)
+    user       = models.ForeignKey(User, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('review', 'user')
+
+    def __str__(self):
+        return f"{self.user.username} found review {self.review_id} helpful"
+
+
+class ProductDailyStats(models.Model):
+    """
+    Sales and views of a product on one day, rolled up from the orders by the ``rollup_seller_stats`` command
+    (see Store/analytics.py). Seller dashboards read these rows only, never the order tables.
+    """
+    product = models.ForeignKey(Product, related_name='daily_stats', on_delete=models.CASCADE)
+    seller  = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)  # copy of product.seller
+    date    = models.DateField()
+    units   = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders  = models.PositiveIntegerField(default=0)
+    views   = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'date'], name='unique_product_daily_stats'),
+        ]
+        indexes = [
+            models.Index(fields=['seller', 'date'], name='daily_stats_seller_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} on {self.date}: {self.units} units"
+
+
+class SellerDailyStats(models.Model):
+    """
+    Distinct orders of a seller on one day. An order of several products of the seller counts once here,
+    but once per product in ProductDailyStats, so the seller totals read their orders from these rows.
+    """
+    seller  = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    date    = models.DateField()
+    orders  = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['seller', 'date'], name='unique_seller_daily_stats'),
+        ]
+
+    def __str__(self):
+        return f"{self.seller_id} on {self.date}: {self.orders} orders"
+
+
+class RollupCheckpoint(models.Model):
+    """How far an incremental rollup got, the next run starts from ``position``."""
+    name     = models.CharField(max_length=50, unique=True)
+    position = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
-        return f"{self.product.name} - {self.user.username} ({self.rating} stars)"
\ No newline at end of file
+        return f"{self.name} at {self.position}"
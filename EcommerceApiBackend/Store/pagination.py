@@ -0,0 +1,185 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as Base64Error
+from datetime import date, datetime
+from decimal import Decimal
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+
+class KeysetPagination(BasePagination):
+    '''
+    Cursor pagination seeking on the full ordering key, e.g. ``(created_at, id)`` or ``(price, id)``.
+
+    The cursor stores the ordering values of the last (or first) row of the page and the next page is
+    read with ``WHERE (price, id) > (:price, :id) ORDER BY price, id LIMIT n``, so with a matching composite
+    index every page costs the same however deep it is. The primary key is always appended to the ordering
+    as tie breaker, in the direction of the first ordering field so a single index serves both directions.
+    Ordering fields must be non nullable columns of the model.
+    '''
+    page_size = api_settings.PAGE_SIZE or 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    ordering = ('-created_at',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        position, self.reverse = self.decode_cursor(request)
+        if position is not None:
+            position = self.parse_position(queryset.model, position)
+
+        ordering = [self._invert(field) for field in self.ordering] if self.reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._seek_filter(ordering, position))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+
+        if self.reverse:
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request, queryset, view):
+        '''Ordering requested through the view's OrderingFilter (if any), with the primary key appended.'''
+        ordering = self.ordering
+        for backend in getattr(view, 'filter_backends', []):
+            if issubclass(backend, OrderingFilter):
+                ordering = backend().get_ordering(request, queryset, view) or ordering
+                break
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        ordering = [field for field in ordering if field.lstrip('-') not in ('id', 'pk')]
+        ordering.append('-id' if ordering and ordering[0].startswith('-') else 'id')
+        return ordering
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            # paged backwards past the first row, start again from the beginning
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, row, reverse):
+        position = [getattr(row, field.lstrip('-')) for field in self.ordering]
+        payload = json.dumps({'p': position, 'r': int(reverse)}, default=self._json_default)
+        cursor = urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        '''Return ``(position, reverse)`` of the requested cursor, ``(None, False)`` for the first page.'''
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded.encode()))
+            position, reverse = payload['p'], bool(payload['r'])
+        except (TypeError, ValueError, KeyError, Base64Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def parse_position(self, model, position):
+        '''Convert the raw cursor values back to python values of the ordering fields.'''
+        values = []
+        for field, value in zip(self.ordering, position):
+            try:
+                values.append(model._meta.get_field(field.lstrip('-')).to_python(value))
+            except FieldDoesNotExist:
+                values.append(value)  # annotation, compared as is
+            except ValidationError:
+                raise NotFound(self.invalid_cursor_message)
+        return values
+
+    @staticmethod
+    def _json_default(value):
+        # keep full microsecond precision, rows created in the same millisecond must not be skipped
+        if isinstance(value, (datetime, date)):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return str(value)
+        raise TypeError(f'{type(value).__name__} can not be used in a cursor')
+
+    @staticmethod
+    def _invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def _seek_filter(ordering, position):
+        '''
+        Row value comparison ``(a, b) > (x, y)`` expanded as ``a >= x AND (a > x OR (a = x AND b > y))``,
+        the leading range on the first column lets the database use the composite index.
+        '''
+        names = [field.lstrip('-') for field in ordering]
+        lookups = ['lt' if field.startswith('-') else 'gt' for field in ordering]
+        condition = Q()
+        for i in range(len(ordering)):
+            term = Q(**{f'{names[i]}__{lookups[i]}': position[i]})
+            for j in range(i):
+                term &= Q(**{names[j]: position[j]})
+            condition |= term
+        return Q(**{f'{names[0]}__{lookups[0]}e': position[0]}) & condition
+
+
+class ProductPagination(KeysetPagination):
+    ordering = ('-created_at',)
+
+
+class OrderPagination(KeysetPagination):
+    ordering = ('-created_at',)
+
+
+class ReviewPagination(KeysetPagination):
+    ordering = ('-created_at',)
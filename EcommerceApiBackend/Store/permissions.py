@@ -26,6 +26,14 @@ class IsSellerOrReadOnly(permissions.BasePermission):
         return request.user and request.user.is_authenticated and request.user.is_seller
     
 
+class IsSeller(permissions.BasePermission):
+    """
+    Allow only sellers, e.g. to their sales analytics.
+    """
+    def has_permission(self, request, view):
+        return request.user and request.user.is_authenticated and request.user.is_seller
+
+
 class IsOrderItemByBuyerOrAdmin(permissions.BasePermission):
     """
     Custom permission to only allow order items created by the buyer or admin to be viewed or updated.
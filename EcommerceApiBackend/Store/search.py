@@ -0,0 +1,125 @@
+'''
+Full text search of products.
+
+PostgreSQL keeps a weighted ``Product.search_vector`` (name > author > category > description) behind a GIN
+index, SQLite (local development) keeps the same columns in an FTS5 virtual table ranked with bm25. Any other
+database falls back to ``icontains`` lookups. Matching products are annotated with ``search_rank``, higher is
+better, which the product ordering uses when no explicit ordering is requested.
+'''
+import re
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, FloatField, OuterRef, Q, Subquery, Value
+from django.db.models.expressions import RawSQL
+from .models import Category, Product
+
+SEARCH_RANK = 'search_rank'
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class LikeSearchBackend:
+    '''Fallback for databases without full text support, substring match on every searchable column.'''
+    fields = ['name', 'author', 'category__name', 'description']
+
+    def setup(self):
+        pass
+
+    def index_products(self, queryset):
+        pass
+
+    def remove_products(self, ids):
+        pass
+
+    def search(self, queryset, terms, author_terms=()):
+        for term in terms:
+            match = Q()
+            for field in self.fields:
+                match |= Q(**{f'{field}__icontains': term})
+            queryset = queryset.filter(match)
+        for term in author_terms:
+            queryset = queryset.filter(author__icontains=term)
+        return queryset.annotate(**{SEARCH_RANK: Value(0.0, output_field=FloatField())})
+
+
+class PostgresSearchBackend(LikeSearchBackend):
+    config = 'english'
+
+    def vector(self):
+        category_name = Subquery(Category.objects.filter(pk=OuterRef('category_id')).values('name')[:1])
+        return (
+            SearchVector('name', weight='A', config=self.config)
+            + SearchVector('author', weight='B', config=self.config)
+            + SearchVector(category_name, weight='C', config=self.config)
+            + SearchVector('description', weight='D', config=self.config)
+        )
+
+    def index_products(self, queryset):
+        queryset.update(search_vector=self.vector())
+
+    def search(self, queryset, terms, author_terms=()):
+        # every term has to match, as a prefix so results show up while typing, author terms only in the author weight
+        lexemes = [f'{term}:*' for term in terms] + [f'{term}:*B' for term in author_terms]
+        query = SearchQuery(' & '.join(lexemes), search_type='raw', config=self.config)
+        return queryset.filter(search_vector=query).annotate(**{SEARCH_RANK: SearchRank(F('search_vector'), query)})
+
+
+class SqliteSearchBackend(LikeSearchBackend):
+    table = 'store_product_fts'
+    # bm25 weights of the name, author, category and description columns
+    weights = (10.0, 5.0, 2.0, 1.0)
+
+    def setup(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} '
+                f"USING fts5(name, author, category, description, tokenize='unicode61 remove_diacritics 2')"
+            )
+
+    def index_products(self, queryset):
+        rows = queryset.values_list('id', 'name', 'author', 'category__name', 'description')
+        with connection.cursor() as cursor:
+            for row in rows.iterator(chunk_size=2000):
+                cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [row[0]])
+                cursor.execute(
+                    f'INSERT INTO {self.table} (rowid, name, author, category, description) VALUES (%s, %s, %s, %s, %s)',
+                    [row[0], row[1], row[2] or '', row[3], row[4]],
+                )
+
+    def remove_products(self, ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [[pk] for pk in ids])
+
+    def search(self, queryset, terms, author_terms=()):
+        query = ' '.join([f'"{term}"*' for term in terms] + [f'author : "{term}"*' for term in author_terms])
+        weights = ', '.join(str(weight) for weight in self.weights)
+        matches = RawSQL(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s', [query])
+        rank = RawSQL(
+            f'SELECT -bm25({self.table}, {weights}) FROM {self.table} '
+            f'WHERE {self.table} MATCH %s AND rowid = {Product._meta.db_table}.id',
+            [query], output_field=FloatField(),
+        )
+        return queryset.filter(id__in=matches).annotate(**{SEARCH_RANK: rank})
+
+
+def get_search_backend():
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    if connection.vendor == 'sqlite':
+        return SqliteSearchBackend()
+    return LikeSearchBackend()
+
+
+def search_products(queryset, text, author=''):
+    '''
+    Filter ``queryset`` down to the products matching every word of ``text`` (and of ``author`` in the
+    author column only), annotated with their rank.
+    '''
+    terms = tokenize(text) if isinstance(text, str) else [t for term in text for t in tokenize(term)]
+    author_terms = tokenize(author) if isinstance(author, str) else [t for term in author for t in tokenize(term)]
+    if not terms and not author_terms:
+        return queryset
+    return get_search_backend().search(queryset, terms, author_terms)
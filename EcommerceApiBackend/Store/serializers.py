@@ -1,9 +1,18 @@
+import json
+from decimal import Decimal
 from django.utils.translation import gettext_lazy as _
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
 from .models import Category , Product,User, Cart , CartItem , Address, Order, OrderItem,Review , Payment
 from rest_framework import serializers
 from rest_framework.exceptions import PermissionDenied
+from .stock import reserve_stock, order_quantities, reservation_deadline
+from .checkout import checkout_cart
+from .caching import invalidate_cart_cache, invalidate_catalog_products
+from .images import variant_urls
 
 class AddressSerializer(serializers.ModelSerializer):
     class Meta:
@@ -44,9 +53,10 @@ class ProfileSerializer(serializers.ModelSerializer):
     '''
     name=serializers.SerializerMethodField()
     address=serializers.SerializerMethodField()
+    profile_img_variants=serializers.SerializerMethodField()
     class Meta:
         model=User
-        fields=['id','username','email','profile_img','name','phone_number','address','is_seller']
+        fields=['id','username','email','profile_img','profile_img_variants','name','phone_number','address','is_seller']
 
     # def perform create 
 
@@ -55,6 +65,9 @@ class ProfileSerializer(serializers.ModelSerializer):
         lastname=obj.last_name or ''
         return f'{firstname} {lastname}'
     
+    def get_profile_img_variants(self,obj):
+        return variant_urls(obj.profile_img_variants, self.context.get('request'))
+
     def get_address(self,obj):
         default_address=Address.objects.filter(is_default=True).first()
         if not default_address:
@@ -71,12 +84,21 @@ class CategorySeriazlizer(serializers.ModelSerializer):
     def get_parent_name(self,category):
         return category.parent.name if category.parent is not None else None
 
+    def validate_parent(self,parent):
+        # a category can not be moved below one of its own subcategories
+        if parent is not None and self.instance is not None and self.instance.path and parent.path.startswith(self.instance.path):
+            raise serializers.ValidationError(_("A category can not be moved under itself or its subcategories."))
+        return parent
+
 
 class ProductSerializer(serializers.ModelSerializer):
     category_name = serializers.SerializerMethodField() # Get the category
+    rating_histogram = serializers.ReadOnlyField()
+    img_variants = serializers.SerializerMethodField()  # resized / webp copies of img, small images for listings
     class Meta:
         model=Product
-        fields= ['id', 'name','img', 'description', 'price', 'category','category_name', 'author','specification','is_in_stock','stock','views','seller']
+        fields= ['id', 'name','img','img_variants', 'description', 'price', 'category','category_name', 'author','specification','is_in_stock','stock','views','seller',
+                 'rating_avg','rating_count','rating_histogram']
 
     def validate(self,data):
         category=data.get('category').name.lower() if data.get('category',None) is not None else ""
@@ -87,6 +109,93 @@ class ProductSerializer(serializers.ModelSerializer):
     def get_category_name(self,obj):
         return obj.category.name
 
+    def get_img_variants(self,obj):
+        return variant_urls(obj.img_variants, self.context.get('request'))
+
+
+class SpecificationField(serializers.JSONField):
+    '''JSON object given as is (NDJSON) or as JSON text (a CSV cell), an empty cell is no specification'''
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            if not data.strip():
+                return None
+            try:
+                data = json.loads(data)
+            except ValueError:
+                self.fail('invalid')
+        return super().to_internal_value(data)
+
+
+class ProductImportSerializer(serializers.ModelSerializer):
+    """
+    One row of a bulk product import, the category is given by name and resolved
+    from the ``categories`` map of the context (lower cased name -> id) without a query
+    """
+    category = serializers.CharField(source='category_id')
+    specification = SpecificationField(required=False, allow_null=True)
+    class Meta:
+        model=Product
+        fields=['name','description','price','stock','category','author','specification']
+
+    def validate_category(self,value):
+        category_id = self.context['categories'].get(value.strip().lower())
+        if category_id is None:
+            raise serializers.ValidationError(_('Unknown category "%(name)s".') % {'name': value})
+        return category_id
+
+    def validate(self,data):
+        category = str(self.initial_data.get('category') or '').strip().lower()
+        if (category == "books" or category == 'book' ) and not  data.get('author'):
+            raise serializers.ValidationError({"author":"This field is required"})
+        return data
+
+
+class ProductBatchItemSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0'), required=False)
+    stock = serializers.IntegerField(min_value=0, max_value=2147483647, required=False)
+
+    def validate(self, data):
+        if 'price' not in data and 'stock' not in data:
+            raise serializers.ValidationError(_('Give a price, a stock or both.'))
+        return data
+
+
+class ProductBatchUpdateSerializer(serializers.Serializer):
+    '''
+    Set the price and / or stock of many products of the seller at once, e.g. an inventory sync:
+    ``{"products": [{"id": 1, "price": "10.00", "stock": 3}, {"id": 2, "stock": 0}]}``.
+    The values replace the current ones, they are not added to them. When a product is listed twice its entries are merged, the last one wins.
+    '''
+    MAX_PRODUCTS = 1000
+
+    products = ProductBatchItemSerializer(many=True, allow_empty=False, max_length=MAX_PRODUCTS)
+
+    def validate_products(self, products):
+        changes = {}
+        for product in products:
+            changes.setdefault(product['id'], {}).update({k: v for k, v in product.items() if k != 'id'})
+        owned = set(Product.objects.filter(pk__in=changes, seller=self.context['request'].user).values_list('pk', flat=True))
+        missing = sorted(set(changes) - owned)
+        if missing:
+            raise serializers.ValidationError(_("Products %(ids)s do not exist or are not yours.") % {'ids': missing})
+        return changes
+
+    def create(self, validated_data):
+        '''Apply the changes with one bulk update per set of changed fields, returns the ids of the products'''
+        changes = validated_data['products']
+        now = timezone.now()
+        groups = {}
+        for product_id, values in changes.items():
+            groups.setdefault(tuple(sorted(values)), []).append(Product(pk=product_id, updated_at=now, **values))
+        with transaction.atomic():
+            for fields, products in groups.items():
+                Product.objects.bulk_update(products, [*fields, 'updated_at'], batch_size=500)
+            # no per row signals, the listings, details and carts showing the products are invalidated once
+            transaction.on_commit(lambda: invalidate_catalog_products(*changes))
+            invalidate_cart_cache(*set(CartItem.objects.filter(product_id__in=changes).values_list('cart__buyer_id', flat=True)))
+        return list(changes)
+
 
 class CartSerializer(serializers.ModelSerializer):
     total_items = serializers.SerializerMethodField()
@@ -95,6 +204,8 @@ class CartSerializer(serializers.ModelSerializer):
         fields=['id','total_items','total_cost','status','updated_at','created_at']
 
     def get_total_items(self,cart):
+        if hasattr(cart, 'annotated_total_items'):
+            return cart.annotated_total_items
         return len(cart.cart_items.all())
 
 
@@ -109,14 +220,97 @@ class CartItemSerializer(serializers.ModelSerializer):
         
     def get_total_cost(self,obj):
         return obj.total_cost
+
+    def validate_product_id(self, product):
+        # a cart holds one line per product, moving a line to another product could collide with its line
+        if self.instance is not None and product.pk != self.instance.product_id:
+            raise serializers.ValidationError(_("The product of a cart line can not be changed, add the product to the cart instead."))
+        return product
     
     def create(self, validated_data):
-        product_id = validated_data.pop('product_id')
-        cartitem = CartItem.objects.create(product=product_id,**validated_data)
+        product = validated_data.pop('product_id')
+        quantity = validated_data.pop('quantity', 1)
+        cartitem, created = CartItem.objects.get_or_create(product=product, defaults={'quantity': quantity}, **validated_data)
+        if not created:
+            # the product is already in the cart, add to its line instead of a second one
+            CartItem.objects.filter(pk=cartitem.pk).update(quantity=F('quantity') + quantity)
+            cartitem.refresh_from_db(fields=['quantity'])
+            invalidate_cart_cache(cartitem.cart.buyer_id)
         return cartitem
+
+    def update(self, instance, validated_data):
+        validated_data.pop('product_id', None)
+        return super().update(instance, validated_data)
+
+
+class CartBatchItemSerializer(serializers.Serializer):
+    MAX_QUANTITY = 1000
+
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, max_value=MAX_QUANTITY, help_text='New quantity of the line, 0 removes it')
+
+
+class CartBatchSerializer(serializers.Serializer):
+    '''
+    Set the quantity of many cart lines at once, e.g. when an offline cart is synced:
+    ``{"items": [{"product_id": 1, "quantity": 3}, {"product_id": 2, "quantity": 0}]}``.
+    When a product is listed twice the last entry wins.
+    '''
+    MAX_ITEMS = 500
+
+    items = CartBatchItemSerializer(many=True, allow_empty=False, max_length=MAX_ITEMS)
+
+    def validate_items(self, items):
+        quantities = {item['product_id']: item['quantity'] for item in items}
+        existing = set(Product.objects.filter(pk__in=quantities).values_list('pk', flat=True))
+        missing = sorted(set(quantities) - existing)
+        if missing:
+            raise serializers.ValidationError(_("Products %(ids)s do not exist.") % {'ids': missing})
+        return quantities
+
+    def create(self, validated_data):
+        quantities = validated_data['items']
+        removed = [product_id for product_id, quantity in quantities.items() if quantity == 0]
+        with transaction.atomic():
+            cart, created = Cart.objects.get_or_create(buyer=self.context['request'].user)
+            if removed:
+                # a single DELETE, the cart cache is invalidated once below
+                CartItem.objects.filter(cart=cart, product_id__in=removed).delete()
+            CartItem.objects.bulk_create(
+                [CartItem(cart=cart, product_id=product_id, quantity=quantity)
+                 for product_id, quantity in quantities.items() if quantity > 0],
+                update_conflicts=True,
+                unique_fields=['cart', 'product'],
+                update_fields=['quantity'],
+            )
+            if cart.status != 'active':
+                Cart.objects.filter(pk=cart.pk).update(status='active')
+            invalidate_cart_cache(cart.buyer_id)
+        return cart
     
 
+class PrefetchedProductField(serializers.PrimaryKeyRelatedField):
+    '''
+    Product primary key field resolved from the ``products`` map a parent serializer fetched in bulk
+    (see OrderWriteSerializer.to_internal_value), one query per item otherwise.
+    '''
+    def to_internal_value(self, data):
+        products = self.context.get('products')
+        if products is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            product = products.get(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if product is None:
+            self.fail('does_not_exist', pk_value=data)
+        return product
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
+    product = PrefetchedProductField(queryset=Product.objects.all())
     price   = serializers.SerializerMethodField()
     cost    = serializers.SerializerMethodField()
     class Meta:
@@ -136,7 +330,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
         order_id = self.context["view"].kwargs.get("order_id",None)
         if  order_id is not None:
             current_item = OrderItem.objects.filter(order__id=order_id, product=product)
-            if not self.instance and current_item.count() > 0:
+            if not self.instance and current_item.exists():
                 error = {"product": _("Product already exists in your order.")}
                 raise serializers.ValidationError(f"error ts - {error}")
 
@@ -145,28 +339,65 @@ class OrderItemSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(error)
 
 
-        if self.context["request"].user == product.seller:
+        if self.context["request"].user.pk == product.seller_id:
             error = _("Adding your own product to your order is not allowed")
             raise PermissionDenied(error)
 
         return validated_data
 
     def get_price(self,obj):
-        return obj.product.price
+        if hasattr(obj, 'unit_price'):
+            return obj.unit_price
+        return obj.price if obj.price is not None else obj.product.price
 
     def get_cost(self,obj):
         return obj.cost
     
 
+class OrderSummarySerializer(serializers.ModelSerializer):
+    '''Order history row, read from the denormalized summary columns of the order only'''
+    total_cost = serializers.DecimalField(source='total_amount', max_digits=12, decimal_places=2, read_only=True)
+    thumbnail = serializers.SerializerMethodField()
+    class Meta:
+        model=Order
+        fields = ['id', 'status', 'item_count', 'total_cost', 'created_at', 'thumbnail']
+
+    def get_thumbnail(self, order):
+        '''Small image of the first ordered product'''
+        product = order.first_product
+        if product is None:
+            return None
+        request = self.context.get('request')
+        variants = variant_urls(product.img_variants, request)
+        if 'thumbnail' in variants:
+            return variants['thumbnail']['jpeg']
+        return request.build_absolute_uri(product.img.url) if request else product.img.url
+
+
 class OrderReadSerializer(serializers.ModelSerializer):
     order_items = OrderItemSerializer(many=True)  # Optional for cart orders
     buyer = serializers.StringRelatedField(read_only=True)  # Show the username as a string
+    # the total written with the items, the same the order history shows
+    total_cost = serializers.DecimalField(source='total_amount', max_digits=12, decimal_places=2, read_only=True)
     class Meta:
         model=Order
         fields = ['id', 'buyer', 'billing_address','shipping_address', 'total_cost', 'status', 'order_items']
         extra_kwargs={'total_cost':{"read_only":True},'order_items':{'read_only':True}}
 
 
+def resolve_order_addresses(user, shipping_address, billing_address):
+    '''
+    Shipping and billing address of a new order, one stands in for the other when missing
+    and the default address of the user is used when neither is given.
+    '''
+    if shipping_address is None and billing_address is None:
+        default_address = user.addresses.filter(is_default=True).first()
+        if default_address is None:
+            raise  serializers.ValidationError("Shipping address and billing address are required")
+        shipping_address = billing_address = default_address
+    return shipping_address or billing_address, billing_address or shipping_address
+
+
 class OrderWriteSerializer(serializers.ModelSerializer):
     buyer = serializers.HiddenField(default=serializers.CurrentUserDefault())
     order_items = serializers.ListField(child=OrderItemSerializer(), write_only=True)
@@ -174,26 +405,65 @@ class OrderWriteSerializer(serializers.ModelSerializer):
         model = Order
         fields = ['id','buyer', 'billing_address', 'shipping_address', 'order_items']
 
+    def to_internal_value(self, data):
+        # fetch every ordered product with one query before the items are validated
+        items = data.get('order_items') if hasattr(data, 'get') else None
+        if isinstance(items, list):
+            product_ids = set()
+            for item in items:
+                try:
+                    product_ids.add(int(item['product']))
+                except (KeyError, TypeError, ValueError):
+                    pass  # reported by the item validation
+            self.context['products'] = Product.objects.in_bulk(product_ids)
+        return super().to_internal_value(data)
+
     def create(self, validated_data):
         orders_data = validated_data.pop("order_items")
-        billing_address = validated_data.get("billing_address",None)
-        shipping_address = validated_data.get("shipping_address",None)
-        if shipping_address is not None  and  billing_address is None:
-            validated_data['billing_address'] = shipping_address
-        elif billing_address is not None and  shipping_address is None:
-            validated_data['shipping_address'] = billing_address
-        elif self.context['request'].user.addresses.all().filter(is_default=True).exists():
-            validated_data['shipping_address'] = self.context['request'].user.addresses.all().filter(is_default=True).first()
-            validated_data['billing_address'] = self.context['request'].user.addresses.all().filter(is_default=True).first()
-        else:
-            raise  serializers.ValidationError("Shipping address and billing address are required")
+        validated_data['shipping_address'], validated_data['billing_address'] = resolve_order_addresses(
+            self.context['request'].user,
+            validated_data.get("shipping_address",None),
+            validated_data.get("billing_address",None),
+        )
 
-        order = Order.objects.create(**validated_data)
-        for order_data in orders_data:
-            OrderItem.objects.create(order=order, **order_data)
+        with transaction.atomic():
+            reserve_stock(order_quantities((item['product'].pk, item['quantity']) for item in orders_data))
+            summary = Order.summarize((item['product'].pk, item['quantity'], item['product'].price) for item in orders_data)
+            order = Order.objects.create(reserved_until=reservation_deadline(), **summary, **validated_data)
+            items = OrderItem.objects.bulk_create(
+                OrderItem(order=order, price=order_data['product'].price, **order_data) for order_data in orders_data
+            )
 
-        return OrderReadSerializer(order).data
+        # the read representation is rendered from these objects instead of querying the items back
+        order._prefetched_objects_cache = {'order_items': items}
+        return order
+
+    def to_representation(self, instance):
+        return OrderReadSerializer(instance, context=self.context).data
+
+
+
+class CheckoutSerializer(serializers.Serializer):
+    '''Place an order with the content of the cart of the current user'''
+    shipping_address = serializers.PrimaryKeyRelatedField(queryset=Address.objects.none(), required=False, allow_null=True)
+    billing_address = serializers.PrimaryKeyRelatedField(queryset=Address.objects.none(), required=False, allow_null=True)
+
+    def get_fields(self):
+        # only addresses of the buyer can be ordered to
+        fields = super().get_fields()
+        addresses = self.context['request'].user.addresses.all()
+        fields['shipping_address'].queryset = fields['billing_address'].queryset = addresses
+        return fields
+
+    def create(self, validated_data):
+        user = self.context['request'].user
+        shipping_address, billing_address = resolve_order_addresses(
+            user, validated_data.get('shipping_address'), validated_data.get('billing_address')
+        )
+        return checkout_cart(user, shipping_address, billing_address)
 
+    def to_representation(self, instance):
+        return OrderReadSerializer(instance, context=self.context).data
 
 
 class PaymentSerializer(serializers.ModelSerializer):
@@ -208,6 +478,6 @@ class ReviewSerializer(serializers.ModelSerializer):
     user = serializers.StringRelatedField(read_only=True)  # Show the username as a string
     class Meta:
         model = Review
-        fields = ['id', 'product', 'user', 'rating', 'review_text', 'created_at']
-        read_only_fields = ['created_at']
+        fields = ['id', 'product', 'user', 'rating', 'review_text', 'helpful_count', 'created_at']
+        read_only_fields = ['product', 'helpful_count', 'created_at']  # product comes from the url
 
@@ -0,0 +1,135 @@
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from .models import User, Category, Product, Cart, CartItem, Order, OrderItem, Review, ProductSpecAttribute
+from .caching import bump_category_tree_version, invalidate_cart_cache, invalidate_catalog_products, invalidate_catalog_categories
+from .caching import invalidate_review_feeds
+from .search import get_search_backend
+from .images import image_pipeline
+from .authentication import user_cache, token_blacklist
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+SEARCHABLE_FIELDS = {'name', 'author', 'description', 'category'}
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_tree(sender, **kwargs):
+    '''Any change to a category invalidates the cached category tree and catalog responses'''
+    bump_category_tree_version()
+    invalidate_catalog_categories()
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_catalog(sender, instance, **kwargs):
+    invalidate_catalog_products(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, update_fields=None, **kwargs):
+    '''Keep the full text search index of the product up to date'''
+    if update_fields is not None and not SEARCHABLE_FIELDS & set(update_fields):
+        return
+    get_search_backend().index_products(Product.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Product)
+def index_product_specification(sender, instance, update_fields=None, **kwargs):
+    '''Keep the specification attribute rows of the product up to date'''
+    if update_fields is not None and 'specification' not in update_fields:
+        return
+    ProductSpecAttribute.objects.index_products(Product.objects.filter(pk=instance.pk))
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_search_backend().remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, **kwargs):
+    '''The category name is part of the search index of its products'''
+    if not created:
+        get_search_backend().index_products(Product.objects.filter(category=instance))
+
+
+@receiver([post_save, post_delete], sender=Cart)
+def invalidate_cart(sender, instance, **kwargs):
+    invalidate_cart_cache(instance.buyer_id)
+
+
+# no post_delete receiver for cart items: with one, every delete of cart items would load and signal each row.
+# Their deleters invalidate the cart cache themselves, see invalidate_carts_of_deleted_product for cascades.
+@receiver(post_save, sender=CartItem)
+def invalidate_cart_of_item(sender, instance, **kwargs):
+    if CartItem.cart.is_cached(instance):
+        buyer_id = instance.cart.buyer_id
+    else:
+        buyer_id = Cart.objects.filter(pk=instance.cart_id).values_list('buyer_id', flat=True).first()
+    if buyer_id is not None:
+        invalidate_cart_cache(buyer_id)
+
+
+@receiver(post_save, sender=Product)
+def invalidate_carts_of_product(sender, instance, created, **kwargs):
+    '''Carts show the price and details of their products'''
+    if not created:
+        invalidate_cart_cache(*CartItem.objects.filter(product=instance).values_list('cart__buyer_id', flat=True))
+
+
+@receiver(pre_delete, sender=Product)
+def invalidate_carts_of_deleted_product(sender, instance, **kwargs):
+    '''The cart lines of the product are deleted with it, read their carts while they still exist'''
+    invalidate_cart_cache(*CartItem.objects.filter(product=instance).values_list('cart__buyer_id', flat=True))
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_rating(sender, instance, **kwargs):
+    '''Deleted reviews (cascades included) leave the rating aggregates of their product, in the delete transaction'''
+    Product.objects.filter(pk=instance.product_id).apply_rating_change(removed=instance.rating)
+
+
+@receiver([post_save, post_delete], sender=Review)
+def invalidate_catalog_of_review(sender, instance, **kwargs):
+    '''Catalog responses show the rating aggregates of the products, and the review feed the review itself'''
+    invalidate_catalog_products(instance.product_id)
+    invalidate_review_feeds(instance.product_id)
+
+
+@receiver([post_save, post_delete], sender=OrderItem)
+def refresh_order_summary(sender, instance, **kwargs):
+    '''Items added, changed or removed one by one (bulk writers set the summary themselves)'''
+    Order.objects.filter(pk=instance.order_id).refresh_summaries()
+
+
+def refresh_product_image_caches(product_id):
+    '''Catalog and carts show the image variants of the product'''
+    invalidate_catalog_products(product_id)
+    invalidate_cart_cache(*CartItem.objects.filter(product_id=product_id).values_list('cart__buyer_id', flat=True))
+
+
+@receiver(post_save, sender=Product)
+def render_product_image(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'img' in update_fields:
+        image_pipeline.schedule(instance, 'img', 'img_variants', on_done=refresh_product_image_caches)
+
+
+@receiver(post_save, sender=User)
+def render_profile_image(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'profile_img' in update_fields:
+        image_pipeline.schedule(instance, 'profile_img', 'profile_img_variants')
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_auth_user(sender, instance, **kwargs):
+    '''Authenticated requests read the user from the cache, a change (deactivation too) must reach them'''
+    user_cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def add_to_token_blacklist(sender, instance, created, **kwargs):
+    if created:
+        token_blacklist.add(instance.token.jti)
+
+
+def setup_search(sender, **kwargs):
+    '''Create the search tables that migrations can not express (sqlite FTS5)'''
+    get_search_backend().setup()
@@ -0,0 +1,91 @@
+'''
+Stock reservation of ordered products.
+
+Placing an order takes the ordered quantities out of ``Product.stock`` inside the order transaction. The product
+rows are locked in primary key order, so concurrent checkouts of overlapping products never deadlock, then
+decremented with a single conditional ``UPDATE ... WHERE stock >= quantity``. If any product is short the whole
+order is rolled back, so stock can never be oversold. Pending orders that are not paid before ``reserved_until``
+give their stock back through ``release_expired_orders`` (see the ``release_expired_orders`` command).
+'''
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, When, Sum
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ValidationError
+from .models import Product, Order, OrderItem
+
+
+class InsufficientStock(ValidationError):
+    default_detail = _('Ordered quantity is more than the stock.')
+    default_code = 'insufficient_stock'
+
+
+def reservation_deadline():
+    return timezone.now() + timedelta(minutes=getattr(settings, 'ORDER_RESERVATION_MINUTES', 30))
+
+
+def _quantity_case(quantities):
+    return Case(*[When(pk=pk, then=quantity) for pk, quantity in quantities.items()])
+
+
+def reserve_stock(quantities):
+    '''
+    Take ``{product_id: quantity}`` out of stock, all or nothing. Must run inside a transaction,
+    raises ``InsufficientStock`` naming the products that are short.
+    '''
+    quantities = {pk: quantity for pk, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+    # lock the rows in a deterministic order before touching them (no-op on sqlite, which locks the database)
+    list(Product.objects.select_for_update().filter(pk__in=quantities).order_by('pk').values_list('pk', flat=True))
+    available = Q()
+    for pk, quantity in quantities.items():
+        available |= Q(pk=pk, stock__gte=quantity)
+    updated = Product.objects.filter(available).update(stock=F('stock') - _quantity_case(quantities))
+    if updated != len(quantities):
+        stocks = dict(Product.objects.filter(pk__in=quantities).values_list('pk', 'stock'))
+        short = sorted(pk for pk, quantity in quantities.items() if stocks.get(pk, 0) < quantity)
+        raise InsufficientStock({'quantity': _('Ordered quantity is more than the stock.'), 'products': short})
+
+
+def release_stock(quantities):
+    '''Put ``{product_id: quantity}`` back in stock'''
+    quantities = {pk: quantity for pk, quantity in quantities.items() if quantity > 0}
+    if quantities:
+        Product.objects.filter(pk__in=quantities).update(stock=F('stock') + _quantity_case(quantities))
+
+
+def order_quantities(items):
+    '''Total quantity per product of ``(product_id, quantity)`` pairs, a product may appear more than once'''
+    quantities = Counter()
+    for product_id, quantity in items:
+        quantities[product_id] += quantity
+    return dict(quantities)
+
+
+def release_expired_orders(now=None):
+    '''
+    Cancel pending orders whose reservation expired and put their items back in stock.
+    Orders already paid or paid in cash on delivery keep their stock. Orders locked by a concurrent
+    payment are skipped and picked up by the next run.
+    Returns the number of cancelled orders.
+    '''
+    now = now or timezone.now()
+    with transaction.atomic():
+        expired = list(
+            Order.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', reserved_until__lt=now)
+            .exclude(Q(payment__status='S') | Q(payment__method='cash_on_delivery'))
+            .values_list('pk', flat=True)
+        )
+        if not expired:
+            return 0
+        quantities = dict(
+            OrderItem.objects.filter(order__in=expired).values_list('product').annotate(total=Sum('quantity'))
+        )
+        release_stock(quantities)
+        Order.objects.filter(pk__in=expired).update(status='cancelled', reserved_until=None, updated_at=now)
+    return len(expired)
@@ -1,3 +1,1033 @@
-from django.test import TestCase
+import json
+import shutil
+import tempfile
+import threading
+from unittest import skipUnless
+from datetime import timedelta
+from io import BytesIO, StringIO
+from PIL import Image
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from decimal import Decimal
+from .serializers import CartBatchSerializer
+from .caching import catalog_cache_key, get_catalog_detail_version
+from .authentication import user_cache, auth_user_key, AUTH_USER_FIELDS
+from .counters import ProductViewBuffer
+from .filters import ProductFilter, ProductSearchQuery
+from .stock import release_expired_orders
+from .analytics import rollup_daily_stats, pending_views
+from .models import User, Category, Product, Cart, CartItem, Address, Order, OrderItem, Review, ReviewVote, Payment, ProductDailyStats
 
 # Create your tests here.
+
+
+class QueryCountTestMixin:
+    '''
+    Helpers asserting that an endpoint runs a fixed number of queries,
+    whatever the number of rows it returns.
+    '''
+
+    def assertEndpointQueries(self, num, url, method='get', **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertLess(response.status_code, 400, response.content)
+        executed = len(context.captured_queries)
+        queries = '\n'.join(query['sql'] for query in context.captured_queries)
+        self.assertEqual(executed, num, f'{executed} queries executed on {url}, expected {num}:\n{queries}')
+        return response
+
+    def assertConstantQueries(self, url, add_rows, method='get', **kwargs):
+        '''Run the endpoint, add more rows with ``add_rows`` and check the query count did not grow.'''
+        with CaptureQueriesContext(connection) as context:
+            getattr(self.client, method)(url, **kwargs)
+        add_rows()
+        return self.assertEndpointQueries(len(context.captured_queries), url, method, **kwargs)
+
+
+class StoreTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', email='seller@example.com', password='pass', is_seller=True)
+        cls.buyer = User.objects.create_user(username='buyer', email='buyer@example.com', password='pass')
+        cls.category = Category.objects.create(name='Electronics')
+        cls.address = Address.objects.create(user=cls.buyer, address_line_1='1 Street', state='State', city='City', zip_code='123456', is_default=True)
+
+    def setUp(self):
+        cache.clear()  # cached carts and listings are keyed by ids the next test reuses
+        user_cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def create_product(self, **kwargs):
+        data = {'name': 'Phone', 'seller': self.seller, 'category': self.category, 'description': 'A phone', 'price': 100, 'stock': 10}
+        data.update(kwargs)
+        return Product.objects.create(**data)
+
+
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        self.electronics = Category.objects.create(name='Electronics')
+        self.phones = Category.objects.create(name='Phones', parent=self.electronics)
+        self.android = Category.objects.create(name='Android', parent=self.phones)
+        self.books = Category.objects.create(name='Books')
+
+    def test_paths_and_lookups(self):
+        self.assertEqual((self.android.path, self.android.depth), (f'{self.electronics.id}/{self.phones.id}/{self.android.id}/', 2))
+        self.assertEqual(set(self.electronics.get_descendants()), {self.electronics, self.phones, self.android})
+        self.assertEqual(set(self.electronics.get_descendants(include_self=False)), {self.phones, self.android})
+        self.assertEqual(list(self.android.get_ancestors()), [self.electronics, self.phones])
+        with self.assertNumQueries(1):
+            breadcrumbs = self.android.get_breadcrumbs()
+        self.assertEqual([crumb['name'] for crumb in breadcrumbs], ['Electronics', 'Phones', 'Android'])
+
+    def test_move_rewrites_subtree(self):
+        self.phones.parent = self.books
+        self.phones.save()
+        self.android.refresh_from_db()
+        self.assertEqual((self.android.path, self.android.depth), (f'{self.books.id}/{self.phones.id}/{self.android.id}/', 2))
+        self.phones.parent = None
+        self.phones.save()
+        self.android.refresh_from_db()
+        self.assertEqual((self.android.path, self.android.depth), (f'{self.phones.id}/{self.android.id}/', 1))
+        self.assertEqual(list(self.android.get_ancestors()), [self.phones])
+
+    def test_move_under_itself_or_descendant_rejected(self):
+        for parent in (self.electronics, self.android):
+            self.electronics.parent = parent
+            with self.assertRaises(ValidationError):
+                self.electronics.save()
+        self.electronics.refresh_from_db()
+        self.assertEqual((self.electronics.parent, self.electronics.path), (None, f'{self.electronics.id}/'))
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='staff', password='pass', is_staff=True))
+        response = client.patch(reverse('category-detail', args=[self.phones.id]), {'parent': self.android.id})
+        self.assertEqual(response.status_code, 400)
+
+    def test_rebuild_category_tree(self):
+        Category.objects.update(path='', depth=0)
+        out = StringIO()
+        call_command('rebuild_category_tree', stdout=out)
+        self.assertIn('4 categories updated', out.getvalue())
+        self.android.refresh_from_db()
+        self.assertEqual((self.android.path, self.android.depth), (f'{self.electronics.id}/{self.phones.id}/{self.android.id}/', 2))
+        self.assertEqual(Category.objects.rebuild_tree(), 0)
+
+
+class CategoryTreeEndpointTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.electronics = Category.objects.create(name='Electronics')
+        self.phones = Category.objects.create(name='Phones', parent=self.electronics)
+
+    def test_nested_tree_revalidated_with_etag(self):
+        url = reverse('category-tree')
+        response = self.client.get(url)
+        self.assertEqual([(node['name'], [child['name'] for child in node['subcategories']]) for node in response.json()],
+                         [('Electronics', ['Phones'])])
+        self.assertEqual(response.json()[0]['subcategories'][0]['subcategories'], [])
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Category.objects.create(name='Books')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([node['name'] for node in response.json()], ['Books', 'Electronics'])
+        etag = response['ETag']
+
+        self.phones.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[1]['subcategories'], [])
+
+
+class EndpointQueryCountTests(QueryCountTestMixin, StoreTestCase):
+    def test_product_list(self):
+        self.create_product()
+        self.assertConstantQueries(reverse('product-list'), lambda: [self.create_product() for _ in range(5)])
+
+    def test_cart_items(self):
+        cart = Cart.objects.create(buyer=self.buyer)
+
+        def add_rows():
+            for _ in range(5):
+                CartItem.objects.create(cart=cart, product=self.create_product(), quantity=2)
+
+        add_rows()
+        self.assertConstantQueries(reverse('cart-list'), add_rows)
+
+    def test_cart_detail(self):
+        cart = Cart.objects.create(buyer=self.buyer)
+
+        def add_rows():
+            for _ in range(5):
+                CartItem.objects.create(cart=cart, product=self.create_product(), quantity=2)
+
+        add_rows()
+        self.assertConstantQueries(reverse('cart-detail'), add_rows)
+
+    def test_order_list(self):
+        def add_rows():
+            for _ in range(3):
+                order = Order.objects.create(buyer=self.buyer, shipping_address=self.address, billing_address=self.address)
+                for _ in range(3):
+                    OrderItem.objects.create(order=order, product=self.create_product(), quantity=1)
+
+        add_rows()
+        self.assertConstantQueries(reverse('order-list'), add_rows)
+
+
+class TotalsTests(StoreTestCase):
+    def test_cart_totals_computed_in_database(self):
+        cart = Cart.objects.create(buyer=self.buyer)
+        CartItem.objects.create(cart=cart, product=self.create_product(price='10.50'), quantity=2)
+        CartItem.objects.create(cart=cart, product=self.create_product(price='3.25'), quantity=4)
+        annotated = Cart.objects.with_totals().get(pk=cart.pk)
+        self.assertEqual(annotated.total_cost(), cart.total_cost())
+        self.assertEqual(annotated.annotated_total_items, 2)
+
+    def test_order_totals_computed_in_database(self):
+        order = Order.objects.create(buyer=self.buyer, shipping_address=self.address, billing_address=self.address)
+        OrderItem.objects.create(order=order, product=self.create_product(price='99.99'), quantity=3)
+        OrderItem.objects.create(order=order, product=self.create_product(price='0.01'), quantity=1)
+        annotated = Order.objects.with_totals().get(pk=order.pk)
+        self.assertEqual(annotated.total_cost, order.total_cost)
+        self.assertEqual([item.cost for item in OrderItem.objects.with_cost().filter(order=order)],
+                         [item.cost for item in order.order_items.all()])
+
+    def test_empty_cart_total_is_zero(self):
+        cart = Cart.objects.create(buyer=self.buyer)
+        self.assertEqual(Cart.objects.with_totals().get(pk=cart.pk).total_cost(), 0)
+
+
+class KeysetPaginationTests(StoreTestCase):
+    def collect(self, url, link='next'):
+        names = []
+        while url:
+            data = self.client.get(url).json()
+            names += [product['name'] for product in data['results']]
+            url = data[link]
+        return names
+
+    def test_walks_every_product_once_with_duplicate_prices(self):
+        for i, price in enumerate([5, 5, 5, 1, 9, 9, 2]):
+            self.create_product(name=f'p{i}', price=price)
+        for ordering, expected in [('price', ['p3', 'p6', 'p0', 'p1', 'p2', 'p4', 'p5']),
+                                   ('-created_at', ['p6', 'p5', 'p4', 'p3', 'p2', 'p1', 'p0'])]:
+            names = self.collect(f"{reverse('product-list')}?page_size=2&ordering={ordering}")
+            self.assertEqual(names, expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(f"{reverse('product-list')}?cursor=invalid")
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductSearchTests(StoreTestCase):
+    def search(self, text):
+        response = self.client.get(reverse('product-list'), {'search': text})
+        return [product['name'] for product in response.json()['results']]
+
+    def test_ranked_by_weighted_fields(self):
+        books = Category.objects.create(name='Books')
+        self.create_product(name='Harry Potter', category=books, author='Rowling', description='wizard story')
+        self.create_product(name='Wizard of Oz', category=books, author='Baum', description='kansas')
+        self.create_product(name='Phone', description='a phone for every wizard')
+        self.create_product(name='Laptop', description='for Rowling fans')
+        self.assertEqual(self.search('wizard'), ['Wizard of Oz', 'Harry Potter', 'Phone'])
+        self.assertEqual(self.search('rowl'), ['Harry Potter', 'Laptop'])
+        self.assertEqual(self.search('wizard kansas'), ['Wizard of Oz'])
+
+    def test_index_follows_category_rename(self):
+        books = Category.objects.create(name='Books')
+        self.create_product(name='Harry Potter', category=books, author='Rowling')
+        books.name = 'Novels'
+        books.save()
+        self.assertEqual(self.search('novels'), ['Harry Potter'])
+        self.assertEqual(self.search('books'), [])
+
+
+class ProductSearchQueryTests(TestCase):
+    index = {'book': [1, 2], 'fantasy book': [2], 'mobile phone': [3]}
+
+    def parse(self, text):
+        query = ProductSearchQuery(text, self.index)
+        return query.min_price, query.max_price, query.category_ids, query.author_terms, query.text_terms
+
+    def test_price_ranges(self):
+        self.assertEqual(self.parse('laptop between 50k and 80,000'), (Decimal(50000), Decimal(80000), None, [], ['laptop']))
+        self.assertEqual(self.parse('under 1k'), (None, Decimal(1000), None, [], []))
+        self.assertEqual(self.parse('more than rs 2.5k'), (Decimal(2500), None, None, [], []))
+        self.assertEqual(self.parse('900-300'), (Decimal(300), Decimal(900), None, [], []))
+
+    def test_categories_and_authors(self):
+        self.assertEqual(self.parse('harry potter fantasy books by j k rowling under 500'),
+                         (None, Decimal(500), [2], ['j', 'k', 'rowling'], ['harry', 'potter']))
+        self.assertEqual(self.parse('mobile phones'), (None, None, [3], [], []))
+
+    def test_malformed_input_is_free_text(self):
+        self.assertEqual(self.parse('under abc by'), (None, None, None, [], ['under', 'abc']))
+
+
+class ProductViewBufferTests(StoreTestCase):
+    @override_settings(PRODUCT_VIEWS_FLUSH_INTERVAL=3600)
+    def test_views_are_buffered_and_flushed_in_batches(self):
+        first, second = self.create_product(), self.create_product()
+        updated_at = Product.objects.get(pk=first.pk).updated_at
+        buffer = ProductViewBuffer()
+        buffer._thread = object()  # flushed by hand below instead of the background thread
+        for _ in range(3):
+            buffer.increment(first.id)
+            buffer.increment(second.id)
+        self.assertEqual(buffer.pending(first.id), 3)
+        self.assertEqual(Product.objects.get(pk=first.pk).views, 0)
+        with self.assertNumQueries(1):
+            self.assertEqual(buffer.flush(), 2)
+        first.refresh_from_db()
+        self.assertEqual((first.views, first.updated_at), (3, updated_at))
+        self.assertEqual(buffer.pending(first.id), 0)
+
+    @override_settings(PRODUCT_VIEWS_FLUSH_INTERVAL=0)
+    def test_increment_views_endpoint(self):
+        product = self.create_product(views=5)
+        self.client.force_authenticate(self.seller)
+        response = self.client.post(reverse('increment-view', args=[product.id]))
+        self.assertEqual(response.json()['views'], 6)
+        product.refresh_from_db()
+        self.assertEqual(product.views, 6)
+
+
+class StockReservationTests(StoreTestCase):
+    def place_order(self, *items):
+        data = {'order_items': [{'product': product.id, 'quantity': quantity} for product, quantity in items]}
+        return self.client.post(reverse('order-list'), data, format='json')
+
+    def test_order_takes_stock_all_or_nothing(self):
+        first, second = self.create_product(stock=3), self.create_product(stock=1)
+        self.assertEqual(self.place_order((first, 2), (second, 1)).status_code, 201)
+        self.assertEqual(self.place_order((first, 1), (second, 1)).status_code, 400)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.stock, second.stock), (1, 0))
+
+    def test_order_query_count_does_not_depend_on_lines(self):
+        products = [self.create_product(stock=5) for _ in range(100)]
+        with CaptureQueriesContext(connection) as context:
+            response = self.place_order(*[(product, 2) for product in products])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['order_items']), 100)
+        self.assertEqual(response.json()['total_cost'], '20000.00')
+        self.assertLessEqual(len(context.captured_queries), 10)
+
+    def test_expired_reservations_are_released(self):
+        product = self.create_product(stock=5)
+        self.place_order((product, 2))
+        self.assertEqual(release_expired_orders(), 0)
+        self.assertEqual(release_expired_orders(now=timezone.now() + timedelta(days=1)), 1)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 5)
+        self.assertEqual(Order.objects.get().status, 'cancelled')
+
+    def test_paid_orders_keep_their_reservation(self):
+        product = self.create_product(stock=5)
+        self.place_order((product, 2))
+        self.place_order((product, 1))
+        paid, cash = Order.objects.order_by('id')
+        Payment.objects.create(order=paid, method='credit_card', amount=200, status='S')
+        Payment.objects.create(order=cash, method='cash_on_delivery', amount=100, status='P')
+        self.assertEqual(release_expired_orders(now=timezone.now() + timedelta(days=1)), 0)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 2)
+        self.assertEqual(set(Order.objects.values_list('status', flat=True)), {'pending'})
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    stock = 5
+    buyers = 12
+
+    def test_single_sku_is_never_oversold(self):
+        seller = User.objects.create_user(username='seller', email='seller@example.com', password='pass', is_seller=True)
+        product = Product.objects.create(name='Phone', seller=seller, category=Category.objects.create(name='Phones'),
+                                         description='A phone', price=100, stock=self.stock)
+        users = []
+        for i in range(self.buyers):
+            user = User.objects.create_user(username=f'buyer{i}', email=f'buyer{i}@example.com', password='pass')
+            Address.objects.create(user=user, address_line_1='1 Street', state='State', city='City', zip_code='123456', is_default=True)
+            users.append(user)
+
+        start = threading.Barrier(self.buyers)
+        results = []
+
+        def checkout(user):
+            client = APIClient()
+            client.force_authenticate(user)
+            start.wait()
+            try:
+                response = client.post(reverse('order-list'), {'order_items': [{'product': product.id, 'quantity': 1}]}, format='json')
+                results.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        self.assertEqual(results.count(201), self.stock)
+        self.assertEqual(results.count(400), self.buyers - self.stock)
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(OrderItem.objects.filter(product=product).count(), self.stock)
+
+
+class CartCheckoutTests(QueryCountTestMixin, StoreTestCase):
+    def test_checkout_converts_cart_into_order(self):
+        cart = Cart.objects.create(buyer=self.buyer)
+        products = [self.create_product(stock=3, price=10) for _ in range(3)]
+        for product in products:
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('cart-checkout'), {}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['total_cost'], '60.00')
+        self.assertEqual(len(response.json()['order_items']), 3)
+        self.assertLessEqual(len(context.captured_queries), 14)
+        cart.refresh_from_db()
+        self.assertEqual((cart.status, cart.cart_items.count()), ('ordered', 0))
+        self.assertEqual(list(Product.objects.values_list('stock', flat=True)), [1, 1, 1])
+        order = Order.objects.get(pk=response.json()['id'])
+        self.assertEqual((order.item_count, order.total_amount, order.first_product_id), (3, Decimal('60.00'), products[0].id))
+
+    def test_checkout_is_all_or_nothing(self):
+        cart = Cart.objects.create(buyer=self.buyer)
+        CartItem.objects.create(cart=cart, product=self.create_product(stock=5), quantity=2)
+        CartItem.objects.create(cart=cart, product=self.create_product(stock=1), quantity=2)
+        response = self.client.post(reverse('cart-checkout'), {}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(cart.cart_items.count(), 2)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(list(Product.objects.values_list('stock', flat=True)), [5, 1])
+
+    def test_empty_cart(self):
+        Cart.objects.create(buyer=self.buyer)
+        self.assertEqual(self.client.post(reverse('cart-checkout'), {}, format='json').status_code, 400)
+
+    def test_only_own_addresses(self):
+        cart = Cart.objects.create(buyer=self.buyer)
+        CartItem.objects.create(cart=cart, product=self.create_product(), quantity=1)
+        other = Address.objects.create(user=self.seller, address_line_1='2 Street', state='State', city='City', zip_code='654321')
+        for field in ('shipping_address', 'billing_address'):
+            response = self.client.post(reverse('cart-checkout'), {field: other.id}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(field, response.json())
+        self.assertFalse(Order.objects.exists())
+        response = self.client.post(reverse('cart-checkout'), {'shipping_address': self.address.id}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+
+class CartBatchTests(StoreTestCase):
+    def test_batch_upserts_and_removes_lines(self):
+        first, second, third = self.create_product(), self.create_product(), self.create_product()
+        cart = Cart.objects.create(buyer=self.buyer)
+        CartItem.objects.create(cart=cart, product=first, quantity=1)
+        CartItem.objects.create(cart=cart, product=second, quantity=1)
+        items = [{'product_id': first.id, 'quantity': 5}, {'product_id': second.id, 'quantity': 0},
+                 {'product_id': third.id, 'quantity': 2}]
+        with self.assertNumQueries(7):
+            response = self.client.post(reverse('cart-batch'), {'items': items}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(dict(cart.cart_items.values_list('product_id', 'quantity')), {first.id: 5, third.id: 2})
+
+    def test_batch_rejects_unknown_products(self):
+        response = self.client.post(reverse('cart-batch'), {'items': [{'product_id': 404, 'quantity': 1}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_batch_rejects_oversized_requests(self):
+        product = self.create_product()
+        response = self.client.post(reverse('cart-batch'), {'items': [{'product_id': product.id, 'quantity': 2 ** 31}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        items = [{'product_id': product.id, 'quantity': 1}] * (CartBatchSerializer.MAX_ITEMS + 1)
+        with self.assertNumQueries(0):
+            response = self.client.post(reverse('cart-batch'), {'items': items}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_adding_a_product_twice_merges_the_line(self):
+        product = self.create_product()
+        for _ in range(2):
+            self.client.post(reverse('cart-create'), {'product_id': product.id, 'quantity': 2}, format='json')
+        self.assertEqual(list(CartItem.objects.values_list('quantity', flat=True)), [4])
+
+    def test_line_can_not_be_moved_to_another_product(self):
+        cart = Cart.objects.create(buyer=self.buyer)
+        first, second = self.create_product(), self.create_product()
+        item = CartItem.objects.create(cart=cart, product=first, quantity=1)
+        CartItem.objects.create(cart=cart, product=second, quantity=1)
+        url = reverse('cart-item-update', args=[item.id])
+        response = self.client.patch(url, {'product_id': second.id, 'quantity': 3}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('product_id', response.json())
+        response = self.client.patch(url, {'product_id': first.id, 'quantity': 3}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(cart.cart_items.order_by('id').values_list('product_id', 'quantity')), [(first.id, 3), (second.id, 1)])
+
+
+class CartCacheTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = self.create_product(price=10)
+        self.cart = Cart.objects.create(buyer=self.buyer)
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=2)
+
+    def test_repeated_reads_do_not_query(self):
+        first = self.client.get(reverse('cart-detail')).json()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('cart-detail')).json(), first)
+        self.client.get(reverse('cart-list'))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('cart-list'))
+
+    def test_invalidated_by_item_and_price_changes(self):
+        self.assertEqual(self.client.get(reverse('cart-detail')).json()['total_cost'], 20)
+        CartItem.objects.create(cart=self.cart, product=self.create_product(price=5), quantity=1)
+        self.assertEqual(self.client.get(reverse('cart-detail')).json()['total_cost'], 25)
+        self.product.price = 20
+        self.product.save()
+        self.assertEqual(self.client.get(reverse('cart-detail')).json()['total_cost'], 45)
+        self.assertEqual(self.client.get(reverse('cart-list')).json()[0]['total_cost'], 40)
+        self.client.delete(reverse('clear-cart'))
+        self.assertEqual(self.client.get(reverse('cart-detail')).json()['total_items'], 0)
+
+    def test_deletes_are_single_statements_and_invalidate(self):
+        other = self.create_product(price=5)
+        item = CartItem.objects.create(cart=self.cart, product=other, quantity=1)
+        self.assertEqual(self.client.get(reverse('cart-detail')).json()['total_items'], 2)
+        self.client.delete(reverse('cart-item-remove', args=[item.id]))
+        self.assertEqual(self.client.get(reverse('cart-detail')).json()['total_items'], 1)
+        self.product.delete()
+        self.assertEqual(self.client.get(reverse('cart-detail')).json()['total_items'], 0)
+
+        CartItem.objects.bulk_create(CartItem(cart=self.cart, product=self.create_product(), quantity=1) for _ in range(3))
+        with CaptureQueriesContext(connection) as context:
+            self.client.delete(reverse('clear-cart'))
+        item_queries = [q['sql'] for q in context.captured_queries if '"Store_cartitem"' in q['sql']]
+        self.assertEqual(len(item_queries), 1)
+        self.assertTrue(item_queries[0].startswith('DELETE'))
+
+
+class CatalogCacheTests(StoreTestCase):
+    def test_listing_cached_per_normalized_params(self):
+        self.create_product(price=10)
+        url = reverse('product-list')
+        first = self.client.get(url, {'min_price': 5, 'ordering': 'price'})
+        self.assertIn('max-age=60', first['Cache-Control'])
+        with self.assertNumQueries(0):
+            again = self.client.get(f'{url}?ordering=price&utm_source=mail&min_price=5')
+        self.assertEqual(again.json(), first.json())
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, {'min_price': 5, 'ordering': 'price'}, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+    def test_product_change_invalidates_listing_and_detail(self):
+        product = self.create_product(price=10)
+        detail = reverse('product-detail', args=[product.id])
+        self.assertEqual(self.client.get(detail).json()['price'], '10.00')
+        self.client.get(reverse('product-list'))
+        product.price = 12
+        product.save()
+        self.assertEqual(self.client.get(detail).json()['price'], '12.00')
+        self.assertEqual(self.client.get(reverse('product-list')).json()['results'][0]['price'], '12.00')
+
+    def test_stale_response_served_while_another_request_rebuilds(self):
+        product = self.create_product(price=10)
+        detail = reverse('product-detail', args=[product.id])
+        self.client.get(detail)
+        product.price = 12
+        product.save()
+        key = catalog_cache_key(f'detail:{product.id}', Request(APIRequestFactory().get(detail)), ())
+        cache.add(f'{key}:lock', 1)  # a rebuild is already running
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(detail).json()['price'], '10.00')
+
+    def test_detail_cached_per_host(self):
+        product = self.create_product(price=10)
+        detail = reverse('product-detail', args=[product.id])
+        self.client.get(detail)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(detail, HTTP_HOST='localhost').status_code, 200)
+
+    def test_versions_bumped_again_on_commit(self):
+        product = self.create_product(price=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.price = 12
+            product.save()
+            # read while the change is not committed yet
+            version = get_catalog_detail_version(product.id)
+        self.assertNotEqual(get_catalog_detail_version(product.id), version)
+
+
+class ProductRatingTests(StoreTestCase):
+    def rate(self, product, rating, username):
+        user = User.objects.create_user(username=username, email=f'{username}@example.com', password='pass')
+        return Review.objects.create(user=user, product=product, rating=rating)
+
+    def test_aggregates_follow_review_changes(self):
+        product = self.create_product()
+        self.rate(product, 5, 'a')
+        review = self.rate(product, 2, 'b')
+        product.refresh_from_db()
+        self.assertEqual((product.rating_avg, product.rating_count), (Decimal('3.50'), 2))
+        self.assertEqual(product.rating_histogram, {1: 0, 2: 1, 3: 0, 4: 0, 5: 1})
+
+        review = Review.objects.get(pk=review.pk)
+        review.rating = 4
+        review.save()
+        product.refresh_from_db()
+        self.assertEqual((product.rating_avg, product.rating_2_count, product.rating_4_count), (Decimal('4.50'), 0, 1))
+
+        review.delete()
+        review.user.delete()
+        Review.objects.get(product=product).user.delete()  # cascade
+        product.refresh_from_db()
+        self.assertEqual((product.rating_avg, product.rating_count, product.rating_5_count), (Decimal('0.00'), 0, 0))
+
+    def test_filter_order_and_rebuild(self):
+        good, bad = self.create_product(name='Good'), self.create_product(name='Bad')
+        self.rate(good, 5, 'a')
+        self.rate(bad, 1, 'b')
+        self.rate(bad, 2, 'c')
+        response = self.client.get(reverse('product-list'), {'min_rating': 4})
+        self.assertEqual([p['name'] for p in response.json()['results']], ['Good'])
+        self.assertEqual(response.json()['results'][0]['rating_histogram']['5'], 1)
+        response = self.client.get(reverse('product-list'), {'ordering': '-rating_avg'})
+        self.assertEqual([p['name'] for p in response.json()['results']], ['Good', 'Bad'])
+
+        Product.objects.update(rating_avg=0, rating_count=0, rating_1_count=0)
+        self.assertEqual(Product.objects.rebuild_ratings(), 2)
+        bad.refresh_from_db()
+        self.assertEqual((bad.rating_avg, bad.rating_count, bad.rating_1_count), (Decimal('1.50'), 2, 1))
+        self.assertEqual(Product.objects.rebuild_ratings(), 0)
+
+
+class ReviewFeedTests(QueryCountTestMixin, StoreTestCase):
+    def review(self, product, username, rating=4):
+        user = User.objects.create_user(username=username, email=f'{username}@example.com', password='pass')
+        return Review.objects.create(user=user, product=product, rating=rating, review_text='Fine')
+
+    def test_public_feed_newest_or_most_helpful(self):
+        product = self.create_product()
+        old, new = self.review(product, 'a'), self.review(product, 'b')
+        self.review(self.create_product(), 'c')
+        ReviewVote.objects.create(review=old, user=self.buyer)
+        Review.objects.filter(pk=old.pk).update(helpful_count=1)
+        url = reverse('review-list', args=[product.id])
+        client = APIClient()  # anonymous
+        self.assertEqual([r['id'] for r in client.get(url).json()['results']], [new.id, old.id])
+        self.assertEqual([r['id'] for r in client.get(url, {'ordering': '-helpful_count'}).json()['results']], [old.id, new.id])
+        self.assertEqual(client.post(url, {'rating': 5}).status_code, 401)
+
+    def test_feed_queries_do_not_grow_with_reviews(self):
+        product = self.create_product()
+        url = reverse('review-list', args=[product.id])
+        def add_review():
+            self.review(product, f'user{Review.objects.count()}')
+            cache.clear()
+        self.assertConstantQueries(url, add_review)
+
+    def test_first_page_cached_until_reviews_change(self):
+        product = self.create_product()
+        url = reverse('review-list', args=[product.id])
+        self.review(product, 'a')
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.client.get(url).json()['results']), 1)
+        response = self.client.post(url, {'rating': 5, 'review_text': 'Great'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(self.client.get(url).json()['results']), 2)
+        self.assertEqual(self.client.post(url, {'rating': 3}).status_code, 400)
+
+    def test_helpful_vote_counted_once(self):
+        review = self.review(self.create_product(), 'a')
+        url = reverse('review-helpful', args=[review.product_id, review.id])
+        self.assertEqual(self.client.post(url).json(), {'helpful_count': 1})
+        self.assertEqual(self.client.post(url).status_code, 200)
+        review.refresh_from_db()
+        self.assertEqual(review.helpful_count, 1)
+
+
+class ProductOrderingTests(StoreTestCase):
+    def list_names(self, **params):
+        return [p['name'] for p in self.client.get(reverse('product-list'), params).json()['results']]
+
+    def test_named_orderings(self):
+        cheap = self.create_product(name='Cheap', price=10, views=5)
+        Product.objects.filter(pk=cheap.pk).update(rating_avg=4)
+        self.create_product(name='Pricey', price=90, views=50)
+        self.assertEqual(self.list_names(ordering='price_asc'), ['Cheap', 'Pricey'])
+        self.assertEqual(self.list_names(ordering='price_desc'), ['Pricey', 'Cheap'])
+        self.assertEqual(self.list_names(ordering='newest'), ['Pricey', 'Cheap'])
+        self.assertEqual(self.list_names(ordering='most_viewed'), ['Pricey', 'Cheap'])
+        self.assertEqual(self.list_names(ordering='top_rated'), ['Cheap', 'Pricey'])
+        self.assertEqual(self.list_names(ordering='-views', category='electronics'), ['Pricey', 'Cheap'])
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    @skipUnless(connection.vendor == 'sqlite', 'plans of tiny tables are only deterministic on sqlite')
+    def test_category_listings_use_index(self):
+        for price in range(5):
+            self.create_product(price=price)
+        products = ProductFilter({'category': 'Electronics'}, Product.objects.all()).qs
+        self.assertUsesIndex(products.order_by('-price', '-id')[:21], 'product_category_price_idx')
+        self.assertUsesIndex(products.order_by('-created_at', '-id')[:21], 'product_category_created_idx')
+        self.assertUsesIndex(Product.objects.order_by('-views', '-id')[:21], 'product_views_id_idx')
+
+
+class ProductFacetTests(StoreTestCase):
+    def test_facets_of_filtered_listing(self):
+        books = Category.objects.create(name='Books')
+        self.create_product(price=200, stock=0)
+        self.create_product(price=700)
+        self.create_product(name='Novel', category=books, author='Rowling', price=300)
+        self.create_product(name='Saga', category=books, author='Rowling', price=30000)
+        url = reverse('product-list')
+        facets = self.client.get(url, {'facets': 'category,price,stock,author'}).json()['facets']
+        self.assertEqual([(c['name'], c['count']) for c in facets['category']], [('Books', 2), ('Electronics', 2)])
+        self.assertEqual([b['count'] for b in facets['price']], [2, 1, 0, 0, 1])
+        self.assertEqual(facets['stock'], {'in_stock': 3, 'out_of_stock': 1})
+        self.assertEqual(facets['author'], [{'name': 'Rowling', 'count': 2}])
+
+        facets = self.client.get(url, {'facets': 'price', 'max_price': 500}).json()['facets']
+        self.assertEqual(list(facets), ['price'])
+        self.assertEqual([b['count'] for b in facets['price']], [2, 0, 0, 0, 0])
+        self.assertNotIn('facets', self.client.get(url).json())
+        self.assertEqual(self.client.get(url, {'facets': 'colour'}).status_code, 400)
+
+    def test_facets_use_one_query_and_are_shared_between_pages(self):
+        self.create_product(price=10)
+        self.create_product(price=20)
+        url = reverse('product-list')
+        with CaptureQueriesContext(connection) as context:
+            first = self.client.get(url, {'facets': 'category,price,stock,author', 'page_size': 1})
+        grouped = [q['sql'] for q in context.captured_queries if 'GROUP BY' in q['sql']]
+        self.assertEqual(len(grouped), 1)
+        with CaptureQueriesContext(connection) as context:
+            second = self.client.get(first.json()['next'])
+        self.assertFalse([q for q in context.captured_queries if 'GROUP BY' in q['sql']])
+        self.assertEqual(second.json()['facets'], first.json()['facets'])
+
+
+class ProductSpecificationTests(StoreTestCase):
+    def test_filter_on_spec_attributes(self):
+        small = self.create_product(name='Small', specification={'ram': 8, 'color': 'Black'})
+        self.create_product(name='Big', specification={'ram': '16', 'color': ['Black', 'White']})
+        self.create_product(name='Plain')
+        url = reverse('product-list')
+        names = lambda params: sorted(p['name'] for p in self.client.get(url, params).json()['results'])
+        self.assertEqual(names({'spec.ram': '16'}), ['Big'])
+        self.assertEqual(names({'spec.ram': ['8', '16']}), ['Big', 'Small'])
+        self.assertEqual(names({'spec.color': 'White'}), ['Big'])
+        self.assertEqual(names({'spec.color': 'Black', 'spec.ram': '8.0'}), ['Small'])
+        self.assertEqual(self.client.get(url, {'spec.ram)': 1}).status_code, 400)
+
+        small.specification = {'ram': 16}
+        small.save()
+        self.assertEqual(names({'spec.ram': '16'}), ['Big', 'Small'])
+
+    def test_attribute_discovery_per_category_subtree(self):
+        phones = Category.objects.create(name='Phones', parent=self.category)
+        self.create_product(category=phones, specification={'ram': 8, 'color': 'Black'})
+        self.create_product(specification={'ram': 8})
+        self.create_product(category=Category.objects.create(name='Books'), specification={'pages': 300})
+        response = self.client.get(reverse('category-specifications', args=[self.category.id]))
+        self.assertEqual(response.json(), {'color': [{'value': 'Black', 'count': 1}], 'ram': [{'value': '8', 'count': 2}]})
+
+
+class ImageVariantTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media_root, IMAGE_PROCESSING_WORKERS=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def upload(self, size=(1600, 900)):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'PNG')
+        return SimpleUploadedFile('photo.png', buffer.getvalue(), content_type='image/png')
+
+    def test_variants_rendered_after_commit_and_exposed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.create_product(img=self.upload())
+        product.refresh_from_db()
+        self.assertEqual(product.img_variants['source'], product.img.name)
+        with default_storage.open(product.img_variants['thumbnail']['webp']) as thumbnail:
+            self.assertEqual(Image.open(thumbnail).size, (200, 113))
+
+        variants = self.client.get(reverse('product-detail', args=[product.id])).json()['img_variants']
+        self.assertEqual(set(variants), {'thumbnail', 'medium', 'large'})
+        self.assertTrue(variants['medium']['jpeg'].startswith('http://testserver/media/product_images/variants/'))
+
+    def test_default_image_and_unchanged_image_not_rendered(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            product = self.create_product()
+        self.assertEqual([callback for callback in callbacks if callback.__qualname__.startswith('ImagePipeline.')], [])
+        self.assertEqual(self.client.get(reverse('product-detail', args=[product.id])).json()['img_variants'], {})
+
+
+@override_settings(SHARED_CACHE=True)
+class CachedAuthenticationTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        Cart.objects.create(buyer=self.buyer)
+        self.refresh = RefreshToken.for_user(self.buyer)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.refresh.access_token}')
+
+    def user_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        tables = ('"Store_user"', '"token_blacklist_')
+        return response, [q['sql'] for q in context.captured_queries if any(table in q['sql'] for table in tables)]
+
+    def test_user_and_blacklist_read_from_cache(self):
+        url = reverse('cart-detail')
+        self.client.get(url)
+        response, queries = self.user_queries(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+        with self.assertNumQueries(0):
+            response = self.client.post(reverse('token-refresh'), {'refresh': str(self.refresh)})
+        self.assertIn('access', response.json())
+
+    def test_deactivated_user_rejected(self):
+        self.client.get(reverse('cart-detail'))
+        self.buyer.is_active = False
+        self.buyer.save()
+        self.assertEqual(self.client.get(reverse('cart-detail')).status_code, 401)
+
+    def test_logout_blacklists_refresh_and_access_token(self):
+        self.client.get(reverse('cart-detail'))
+        self.assertEqual(self.client.post(reverse('logout'), {'refresh': str(self.refresh)}).status_code, 205)
+        self.assertEqual(self.client.get(reverse('cart-detail')).status_code, 401)
+        self.client.credentials()
+        self.assertEqual(self.client.post(reverse('token-refresh'), {'refresh': str(self.refresh)}).status_code, 401)
+
+    def test_password_hash_not_cached(self):
+        self.client.get(reverse('cart-detail'))
+        cached = cache.get(auth_user_key(self.buyer.pk))
+        self.assertNotIn(self.buyer.password, cached)
+        self.assertEqual(len(cached), len(AUTH_USER_FIELDS))
+        self.assertEqual(self.client.get(reverse('profile-detail')).json()['username'], 'buyer')
+
+    @override_settings(SHARED_CACHE=False)
+    def test_blacklist_read_from_database_without_shared_cache(self):
+        self.client.get(reverse('cart-detail'))
+        self.assertIsNone(cache.get(auth_user_key(self.buyer.pk)))
+        # blacklisted by another process, this one is not told
+        outstanding = OutstandingToken.objects.get(jti=self.refresh['jti'])
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=outstanding)])
+        self.client.credentials()
+        self.assertEqual(self.client.post(reverse('token-refresh'), {'refresh': str(self.refresh)}).status_code, 401)
+
+
+class OrderSummaryTests(StoreTestCase):
+    def test_history_lists_summaries_and_detail_nests_items(self):
+        first, second = self.create_product(price='10.50'), self.create_product(price=3)
+        self.client.post(reverse('order-list'), {'order_items': [{'product': first.id, 'quantity': 2}, {'product': second.id, 'quantity': 1}]}, format='json')
+        summary = self.client.get(reverse('order-list')).json()['results'][0]
+        self.assertEqual(
+            {key: summary[key] for key in ('status', 'item_count', 'total_cost')},
+            {'status': 'pending', 'item_count': 2, 'total_cost': '24.00'},
+        )
+        self.assertTrue(summary['thumbnail'].endswith('defaultProduct.png'))
+        self.assertNotIn('order_items', summary)
+        detail = self.client.get(reverse('order-detail', args=[summary['id']])).json()
+        self.assertEqual(len(detail['order_items']), 2)
+
+    def test_summary_follows_item_changes(self):
+        order = Order.objects.create(buyer=self.buyer, shipping_address=self.address, billing_address=self.address)
+        first = OrderItem.objects.create(order=order, product=self.create_product(price=5), quantity=2)
+        second = OrderItem.objects.create(order=order, product=self.create_product(price=7), quantity=1)
+        order.refresh_from_db()
+        self.assertEqual((order.item_count, order.total_amount, order.first_product_id), (2, Decimal('17.00'), first.product_id))
+        first.delete()
+        order.refresh_from_db()
+        self.assertEqual((order.item_count, order.total_amount, order.first_product_id), (1, Decimal('7.00'), second.product_id))
+        second.delete()
+        order.refresh_from_db()
+        self.assertEqual((order.item_count, order.total_amount, order.first_product_id), (0, Decimal('0.00'), None))
+
+    def test_totals_keep_the_prices_when_ordered(self):
+        first, second = self.create_product(price=10), self.create_product(price=3)
+        self.client.post(reverse('order-list'), {'order_items': [{'product': first.id, 'quantity': 2}, {'product': second.id, 'quantity': 1}]}, format='json')
+        order = Order.objects.get()
+        Product.objects.filter(pk__in=[first.pk, second.pk]).update(price=100)
+        item = order.order_items.get(product=second)
+        item.quantity = 2
+        item.save()
+        summary = self.client.get(reverse('order-list')).json()['results'][0]
+        detail = self.client.get(reverse('order-detail', args=[order.id])).json()
+        self.assertEqual(summary['total_cost'], '26.00')
+        self.assertEqual(detail['total_cost'], '26.00')
+        self.assertEqual(sorted((item['price'], item['cost']) for item in detail['order_items']), [(3.0, 6.0), (10.0, 20.0)])
+
+
+class SellerAnalyticsTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.seller)
+
+    def order(self, *items, status='pending'):
+        order = Order.objects.create(buyer=self.buyer, shipping_address=self.address, billing_address=self.address, status=status)
+        OrderItem.objects.bulk_create(OrderItem(order=order, product=product, quantity=quantity) for product, quantity in items)
+        return order
+
+    def test_rollup_is_incremental_and_endpoints_read_it(self):
+        book, pen = self.create_product(name='Book', price=100), self.create_product(name='Pen', price=5)
+        self.order((book, 2), (pen, 10))
+        self.order((book, 1))
+        self.order((pen, 50), status='cancelled')
+        Product.objects.filter(pk=book.pk).update(views=30)
+        self.assertEqual(rollup_daily_stats(), (1, 1))
+        self.assertEqual(rollup_daily_stats(), (1, 0))  # today is in the overlap window, recomputed to the same rows
+
+        url = lambda name: reverse(f'seller-analytics-{name}')
+        with self.assertNumQueries(2):  # product rows and seller order rows
+            summary = self.client.get(url('summary')).json()
+        # the book + pen order counts once for the seller
+        self.assertEqual({k: summary[k] for k in ('revenue', 'units', 'orders', 'views')},
+                         {'revenue': '350.00', 'units': 13, 'orders': 2, 'views': 30})
+        top = self.client.get(url('top-products')).json()
+        self.assertEqual([(p['name'], p['revenue'], p['conversion']) for p in top], [('Book', '300.00', 0.0667), ('Pen', '50.00', None)])
+        daily = self.client.get(url('daily'), {'start': timezone.localdate() - timedelta(days=2)}).json()
+        self.assertEqual([(day['units'], day['orders']) for day in daily], [(0, 0), (0, 0), (13, 2)])
+
+        Product.objects.filter(pk=pen.pk).update(views=4)
+        self.order((pen, 1))
+        self.assertEqual(rollup_daily_stats(), (1, 1))
+        self.assertEqual(self.client.get(url('top-products'), {'sort': 'views'}).json()[1]['views'], 4)
+        self.assertEqual(self.client.get(url('summary'), {'start': 'yesterday'}).status_code, 400)
+
+    def test_views_rollup_reads_uncounted_views_only(self):
+        product = self.create_product()
+        Product.objects.filter(pk=product.pk).update(views=5)
+        self.assertEqual(rollup_daily_stats(), (0, 1))
+        Product.objects.filter(pk=product.pk).update(views=8)
+        self.assertEqual(rollup_daily_stats(), (0, 1))
+        self.assertEqual(rollup_daily_stats(), (0, 0))
+        self.assertEqual(list(ProductDailyStats.objects.values_list('views', flat=True)), [8])
+        self.assertEqual(Product.objects.get(pk=product.pk).views_counted, 8)
+        Product.objects.update(views_counted=0)
+        self.assertEqual(rollup_daily_stats(full=True), (0, 0))  # counted views are taken back from the daily rows
+        if connection.vendor == 'sqlite':
+            self.assertIn('product_views_pending_idx', pending_views().order_by('id')[:500].explain())
+
+    def test_item_change_after_rollup_recomputes_the_day(self):
+        book = self.create_product(price=100)
+        order = self.order((book, 2))
+        earlier = timezone.now() - timedelta(days=3)
+        Order.objects.filter(pk=order.pk).update(created_at=earlier, updated_at=earlier)
+        self.assertEqual(rollup_daily_stats(), (1, 0))
+        self.assertEqual(rollup_daily_stats(), (0, 0))
+        item = order.order_items.get()
+        item.quantity = 5
+        item.save()
+        self.assertEqual(rollup_daily_stats(), (1, 0))
+        self.assertEqual(ProductDailyStats.objects.get(date=timezone.localdate(earlier)).units, 5)
+
+    def test_only_sellers_see_their_own_stats(self):
+        self.client.force_authenticate(self.buyer)
+        self.assertEqual(self.client.get(reverse('seller-analytics-summary')).status_code, 403)
+
+
+class ProductBulkTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.seller)
+
+    def upload(self, name, content, **params):
+        return self.client.post(reverse('product-import'), {'file': SimpleUploadedFile(name, content.encode()), **params})
+
+    def test_csv_import_reports_invalid_rows(self):
+        Category.objects.create(name='Books')
+        content = (
+            'name,description,price,stock,category,author,specification\n'
+            'Phone,"A phone, black",100,5,electronics,,"{""ram"": 8}"\n'
+            'Novel,A novel,20,3,Books,,\n'
+            'Lamp,A lamp,abc,1,Furniture,,\n'
+            'Novel,A novel,20,3,books,Someone,\n'
+        )
+        response = self.upload('products.csv', content)
+        self.assertEqual(response.status_code, 201)
+        report = response.json()
+        self.assertEqual((report['created'], report['failed']), (2, 2))
+        self.assertEqual([(error['line'], sorted(error['errors'])) for error in report['errors']], [(3, ['author']), (4, ['category', 'price'])])
+        phone = Product.objects.get(name='Phone')
+        self.assertEqual((phone.seller, phone.category, phone.specification), (self.seller, self.category, {'ram': 8}))
+        self.assertEqual(self.client.get(reverse('product-list'), {'search': 'phone', 'spec.ram': 8}).json()['results'][0]['id'], phone.id)
+
+    def test_ndjson_import_and_export_round_trip(self):
+        self.create_product(name='Phone', specification={'ram': 8})
+        self.create_product(name='Other', seller=self.buyer)
+        exported = self.client.get(reverse('product-export'), {'file_format': 'ndjson'})
+        self.assertEqual(exported['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(exported.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['name'] for line in lines], ['Phone'])
+
+        self.client.get(reverse('product-list'))
+        response = self.upload('products.ndjson', '\n'.join(lines + ['[1]', '']))
+        self.assertEqual((response.json()['created'], response.json()['failed']), (1, 1))
+        self.assertEqual(len(self.client.get(reverse('product-list')).json()['results']), 3)
+
+        csv_export = b''.join(self.client.get(reverse('product-export')).streaming_content).decode()
+        self.assertEqual(csv_export.splitlines()[0], 'id,name,description,price,stock,category,author,specification')
+        self.assertEqual(csv_export.count('"{""ram"": 8}"'), 2)
+
+    def test_only_sellers_and_known_formats(self):
+        self.assertEqual(self.upload('products.txt', 'x').status_code, 400)
+        self.client.force_authenticate(self.buyer)
+        self.assertEqual(self.client.get(reverse('product-export')).status_code, 403)
+
+    def test_batch_update_of_price_and_stock(self):
+        phone, lamp = self.create_product(name='Phone'), self.create_product(name='Lamp', price=30, stock=2)
+        cart = Cart.objects.create(buyer=self.buyer)
+        CartItem.objects.create(cart=cart, product=phone, quantity=1)
+        self.client.force_authenticate(self.buyer)
+        self.client.get(reverse('cart-list'))
+        self.client.force_authenticate(self.seller)
+        self.client.get(reverse('product-detail', args=[phone.id]))
+
+        url = reverse('product-batch-update')
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(6):  # ownership, savepoint, one UPDATE per field set, cart owners, release
+            response = self.client.post(url, {'products': [
+                {'id': phone.id, 'price': '80.00'}, {'id': lamp.id, 'stock': 0}, {'id': phone.id, 'stock': 4},
+            ]}, format='json')
+        self.assertEqual(response.json(), {'updated': 2})
+        self.assertEqual(list(Product.objects.order_by('id').values_list('price', 'stock')), [(Decimal('80.00'), 4), (Decimal('30.00'), 0)])
+        self.assertEqual(self.client.get(reverse('product-detail', args=[phone.id])).json()['price'], '80.00')
+        self.client.force_authenticate(self.buyer)
+        self.assertEqual(self.client.get(reverse('cart-list')).json()[0]['product']['stock'], 4)
+
+        other = self.create_product(seller=self.buyer)
+        self.client.force_authenticate(self.seller)
+        response = self.client.post(url, {'products': [{'id': other.id, 'stock': 1}, {'id': phone.id}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(url, {'products': [{'id': phone.id, 'stock': 2 ** 31}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Product.objects.get(pk=other.pk).stock, 10)
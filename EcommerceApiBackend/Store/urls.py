@@ -12,13 +12,13 @@ router.register('categories',views.CategoryViewset,basename='category')
 router.register('cart',views.CartViewset,basename='cart')                                           ## cart's  endpoints
 router.register('user/orders',views.OrderViewSet,basename='order')                                  ## order's  endpoints                      ## orderitem's  endpoints
 router.register('addresses', views.AddressViewSet, basename='address')
-router.register('products/<int:product_id>/reviews',views.ReviewViewSet,basename='reviews')         #### reviews's  endpoints
+router.register('seller/analytics', views.SellerAnalyticsViewSet, basename='seller-analytics')         ## seller dashboard endpoints
 
 urlpatterns = [
     # path('',include(router.urls)),
     path('auth/register/',views.RegisterView,name='register'),
     path('auth/login/',TokenObtainPairView.as_view(),name='token-obtain'),
-    path('auth/logout/',views.LogoutView.as_view(),name='token-obtain'),
+    path('auth/logout/',views.LogoutView.as_view(),name='logout'),
     path('auth/token/refresh/',TokenRefreshView.as_view(),name='token-refresh'),
 
     ####  PROFILE ENPOINTS
@@ -30,6 +30,14 @@ urlpatterns = [
     path('products/<int:pk>/detail/',views.ProductViewset.as_view({'get':'retrieve'}),name='product-detail'),      
     path('products/<int:pk>/update/',views.ProductViewset.as_view({'put':'update'}),name='product-update'),        
     path('products/<int:pk>/increment-views/',views.ProductViewset.as_view({"post":"increase_views"}),name='increment-view'),        
+    path('products/import/',views.ProductViewset.as_view({'post':'bulk_import'}),name='product-import'),
+    path('products/export/',views.ProductViewset.as_view({'get':'export'}),name='product-export'),
+    path('products/batch-update/',views.ProductViewset.as_view({'post':'batch_update'}),name='product-batch-update'),
+
+    ### REVIEW ENDPOINTS
+    path('products/<int:product_id>/reviews/',views.ReviewViewSet.as_view({'get':'list','post':'create'}),name='review-list'),
+    path('products/<int:product_id>/reviews/<int:pk>/',views.ReviewViewSet.as_view({'get':'retrieve','put':'update','patch':'partial_update','delete':'destroy'}),name='review-detail'),
+    path('products/<int:product_id>/reviews/<int:pk>/helpful/',views.ReviewViewSet.as_view({'post':'helpful'}),name='review-helpful'),
 
 
     ### CART ENDPOINTS
@@ -39,6 +47,8 @@ urlpatterns = [
     path('cart/update-item/<int:item_id>/',views.CartViewset.as_view({'patch':'update','put':'update'}),name='cart-item-update'),
     path('cart/remove-item/<int:item_id>/',views.CartViewset.as_view({'delete':'destroy'}),name='cart-item-remove'),
     path('cart/clear/',views.CartViewset.as_view({'delete':'clear_cart'}),name='clear-cart'),
+    path('cart/batch/',views.CartViewset.as_view({'post':'batch'}),name='cart-batch'),
+    path('cart/checkout/',views.CartViewset.as_view({'post':'checkout'}),name='cart-checkout'),
 
 
     path('order/<int:order_id>/order-items/', views.OrderItemViewSet.as_view({
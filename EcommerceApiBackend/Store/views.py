@@ -1,19 +1,31 @@
 from django.shortcuts import get_object_or_404
 from django.http import JsonResponse
+from django.db import transaction
+from django.db.models import Count, F, Prefetch
+from django.utils.http import quote_etag, parse_etags
 from rest_framework.decorators import api_view,permission_classes ,action
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny,IsAuthenticated,IsAdminUser
+from rest_framework.permissions import AllowAny,IsAuthenticated,IsAdminUser,IsAuthenticatedOrReadOnly
 from rest_framework.views import APIView 
-from rest_framework.filters import SearchFilter
+from rest_framework.filters import SearchFilter, OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.exceptions import ValidationError
 from rest_framework import status,viewsets , generics 
-from .permissions import  IsAdminOrStaff,IsSellerOrReadOnly , IsOrderItemByBuyerOrAdmin , IsOrderItemPending,IsOrderPending, IsOrderByBuyerOrAdmin
+from .permissions import  IsAdminOrStaff,IsSellerOrReadOnly ,IsSeller , IsOrderItemByBuyerOrAdmin , IsOrderItemPending,IsOrderPending, IsOrderByBuyerOrAdmin
 import stripe
-from .filters import ProductFilter,CustomSearchFilter
-from .models import User, Product , Category , Cart , CartItem , Order, OrderItem , Review , Payment , Address
-from .serializers import UserSerializer,ProfileSerializer,ProductSerializer, CategorySeriazlizer , CartItemSerializer,OrderReadSerializer,OrderWriteSerializer, ReviewSerializer , PaymentSerializer , CartSerializer , OrderItemSerializer,AddressSerializer
+from .filters import ProductFilter,CustomSearchFilter,ProductOrderingFilter,SPEC_PARAM_PREFIX
+from .caching import get_category_tree_version, get_category_tree, get_cached_cart, invalidate_cart_cache
+from .caching import catalog_cache_key, cached_catalog_response, get_catalog_list_version, get_catalog_detail_version
+from .caching import get_review_feed_version, invalidate_review_feeds, get_cached_catalog_data
+from .facets import parse_facets, compute_facets
+from .pagination import ProductPagination, OrderPagination, ReviewPagination
+from .counters import product_views
+from .authentication import CachedRefreshToken, blacklist_token
+from .bulk import parse_file_format, import_products, export_response
+from .analytics import parse_date_range, seller_summary, seller_daily, seller_top_products, TOP_PRODUCTS_LIMIT
+from .models import User, Product , Category , Cart , CartItem , Order, OrderItem , Review , ReviewVote , Payment , Address , ProductSpecAttribute
+from .serializers import UserSerializer,ProfileSerializer,ProductSerializer, CategorySeriazlizer , CartItemSerializer,OrderReadSerializer,OrderWriteSerializer,OrderSummarySerializer, ProductBatchUpdateSerializer, ReviewSerializer , PaymentSerializer , CartSerializer , OrderItemSerializer,AddressSerializer,CheckoutSerializer,CartBatchSerializer
 # Create your views here.
 
 
@@ -48,8 +60,10 @@ class LogoutView(APIView):
     def post(self, request):
         try:
             refresh_token = request.data["refresh"]
-            token = RefreshToken(refresh_token)
+            token = CachedRefreshToken(refresh_token)
             token.blacklist()  # Blacklist the refresh token , refresh token can't be further used to generate access token 
+            if request.auth is not None:
+                blacklist_token(request.auth)  # and the access token used for logging out
             return Response(status=status.HTTP_205_RESET_CONTENT)
         except Exception as e:
             # print(e)
@@ -60,7 +74,8 @@ class LogoutView(APIView):
 class ProfileView(generics.RetrieveUpdateAPIView):
     serializer_class=ProfileSerializer
     def get_object(self):
-        return self.request.user
+        # request.user only holds the fields authentication needs
+        return User.objects.get(pk=self.request.user.pk)
     
     def update(self, request, *args, **kwargs):
         instance=self.get_object()
@@ -80,16 +95,59 @@ class ProfileView(generics.RetrieveUpdateAPIView):
 
 
 class ProductViewset(viewsets.ModelViewSet):
-    queryset = Product.objects.all()
+    queryset = Product.objects.select_related('category')
     serializer_class = ProductSerializer
     permission_classes = [IsSellerOrReadOnly]
-    filter_backends=[DjangoFilterBackend,CustomSearchFilter]  # use search filter for searching , and DjangoFilterBackend for filtering products on basis of fields 
+    filter_backends=[DjangoFilterBackend,CustomSearchFilter,ProductOrderingFilter]  # use search filter for searching , and DjangoFilterBackend for filtering products on basis of fields 
     search_fields=['name','category__name','description','author']
     filterset_class=ProductFilter
+    ordering_fields=['created_at','price','views','rating_avg','rating_count']
+    ordering=['-created_at']
+    pagination_class=ProductPagination
+    facets_param = 'facets'
   
+    def get_permissions(self):
+        if self.action in ('bulk_import', 'export', 'batch_update'):
+            return [IsSeller()]
+        return super().get_permissions()
+
     def perform_create(self,serializer):
         serializer.save(seller=self.request.user)
 
+    def get_filter_params(self):
+        '''Query parameters that select the listed products'''
+        specs = [name for name in self.request.query_params if name.startswith(SPEC_PARAM_PREFIX)]
+        return [*self.filterset_class.base_filters, CustomSearchFilter.search_param, *specs]
+
+    def get_catalog_params(self):
+        '''Query parameters that change the listing, everything else shares the cached response'''
+        paginator = self.paginator
+        return [*self.get_filter_params(), ProductOrderingFilter.ordering_param, self.facets_param,
+                paginator.cursor_query_param, paginator.page_size_query_param]
+
+    def list(self, request, *args, **kwargs):
+        facets = parse_facets(request.query_params.get(self.facets_param, ''))
+
+        def build():
+            data = super(ProductViewset, self).list(request, *args, **kwargs).data
+            if facets:
+                data['facets'] = self.get_facets(request, facets)
+            return data
+
+        key = catalog_cache_key('list', request, self.get_catalog_params())
+        return cached_catalog_response(request, key, get_catalog_list_version(), build)
+
+    def get_facets(self, request, facets):
+        '''Facet counts of the filtered listing, cached per filter signature so every page and ordering shares them'''
+        key = catalog_cache_key(f'facets:{",".join(facets)}', request, self.get_filter_params())
+        build = lambda: compute_facets(self.filter_queryset(self.get_queryset()), facets)
+        return get_cached_catalog_data(key, get_catalog_list_version(), build)
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = self.kwargs['pk']
+        build = lambda: super(ProductViewset, self).retrieve(request, *args, **kwargs).data
+        return cached_catalog_response(request, catalog_cache_key(f'detail:{pk}', request, ()), get_catalog_detail_version(pk), build)
+
      # Override the update method to handle partial updates with PUT
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -101,31 +159,97 @@ class ProductViewset(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['post'],url_path='increment-views')
     def increase_views(self, request, pk=None):
-        """Increase the views count of a specific product"""
+        """Increase the views count of a specific product, written to the database in batches"""
         product = self.get_object()
-        product.views += 1
-        product.save()
-        return Response({"status": "success", "views": product.views,'product_id':product.id}, status=status.HTTP_200_OK)
+        views = product.views + product_views.pending(product.id) + 1
+        product_views.increment(product.id)
+        return Response({"status": "success", "views": views,'product_id':product.id}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def bulk_import(self, request):
+        """
+        Create products of the seller from an uploaded CSV or NDJSON ``file`` (format from the extension or
+        ``file_format``), valid rows are saved and the invalid ones reported with their line and errors
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': 'No file was submitted.'})
+        file_format = parse_file_format(request.data.get('file_format') or request.query_params.get('file_format'), upload.name)
+        report = import_products(upload, file_format, request.user)
+        return Response(report, status=status.HTTP_201_CREATED if report['created'] else status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['post'], url_path='batch-update')
+    def batch_update(self, request):
+        """Set price and / or stock of up to 1000 products of the seller in one transaction"""
+        serializer = ProductBatchUpdateSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        updated = serializer.save()
+        return Response({'updated': len(updated)}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream all products of the seller as ``?file_format=csv`` (default) or ``ndjson``"""
+        file_format = parse_file_format(request.query_params.get('file_format', 'csv'))
+        return export_response(Product.objects.filter(seller=request.user), file_format)
 
 
 class CategoryViewset(viewsets.ModelViewSet):
-    queryset = Category.objects.all()
+    queryset = Category.objects.select_related('parent')
     permission_classes=[IsAdminOrStaff]
     serializer_class = CategorySeriazlizer
 
+    @action(detail=False, methods=['get'])
+    def tree(self, request):
+        """Whole nested category tree, served from cache and revalidated with ETag"""
+        version = get_category_tree_version()
+        etag = quote_etag(version)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(get_category_tree(version))
+        response['ETag'] = etag
+        return response
+
+    @action(detail=True, methods=['get'])
+    def specifications(self, request, pk=None):
+        """Specification attributes of the products of the category and its subcategories, with value counts"""
+        category = self.get_object()
+
+        def build():
+            rows = (
+                ProductSpecAttribute.objects.filter(product__category__path__startswith=category.path)
+                .values_list('key', 'value').annotate(count=Count('id')).order_by('key', '-count', 'value')
+            )
+            attributes = {}
+            for key, value, count in rows:
+                attributes.setdefault(key, []).append({'value': value, 'count': count})
+            return attributes
+
+        key = f'catalog:specifications:{category.pk}'
+        return Response(get_cached_catalog_data(key, get_catalog_list_version(), build))
+
 
 class CartDetailView(generics.RetrieveAPIView):
     serializer_class = CartSerializer
     def get_object(self):
-        return get_object_or_404(Cart, buyer=self.request.user)
+        queryset = Cart.objects.with_totals()
+        return get_object_or_404(queryset, buyer=self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
+        # served from the per user cart cache, invalidated by cart and product changes (see Store/signals.py)
+        data = get_cached_cart(request.user.pk, 'detail', lambda: self.get_serializer(self.get_object()).data)
+        return Response(data)
 
 class CartViewset(viewsets.ModelViewSet): 
     queryset = CartItem.objects.all()
     serializer_class = CartItemSerializer
 
     def get_queryset(self):
-        cart, created = Cart.objects.get_or_create(buyer=self.request.user)
-        return CartItem.objects.filter(cart=cart)
+        return CartItem.objects.filter(cart__buyer=self.request.user).select_related('product__category')
+
+    def list(self, request, *args, **kwargs):
+        data = get_cached_cart(request.user.pk, 'items', lambda: self.get_serializer(self.get_queryset(), many=True).data)
+        return Response(data)
     
     def get_object(self):
         queryset = self.get_queryset()
@@ -134,9 +258,15 @@ class CartViewset(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         '''Add item to cart '''
-        cart=get_object_or_404(Cart,buyer=self.request.user)
+        cart, created = Cart.objects.get_or_create(buyer=self.request.user)
+        if cart.status != 'active':
+            Cart.objects.filter(pk=cart.pk).update(status='active')  # a new cart after checkout
         serializer.save(cart=cart)
 
+    def perform_destroy(self, instance):
+        instance.delete()
+        invalidate_cart_cache(self.request.user.pk)
+
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
         serializer = self.get_serializer(instance, data=request.data, partial=True)  # Set partial=True for PUT requests
@@ -144,10 +274,31 @@ class CartViewset(viewsets.ModelViewSet):
         self.perform_update(serializer)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    @action(detail=False,methods=['post'])
+    def batch(self,request):
+        '''Upsert and remove many cart lines in one transaction, returns the whole cart content'''
+        serializer=CartBatchSerializer(data=request.data,context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        items=self.get_serializer(self.get_queryset(),many=True)
+        return Response(items.data, status=status.HTTP_200_OK)
+
+    @action(detail=False,methods=['post'])
+    def checkout(self,request):
+        '''Convert the cart into an order in a single transaction and empty it'''
+        serializer=CheckoutSerializer(data=request.data,context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        order=serializer.save()
+        order=Order.objects.prefetch_related(
+            Prefetch('order_items', queryset=OrderItem.objects.with_cost())
+        ).select_related('buyer').get(pk=order.pk)
+        return Response(OrderReadSerializer(order,context=self.get_serializer_context()).data, status=status.HTTP_201_CREATED)
+
     @action(detail=False,methods=['delete'])
     def clear_cart(self,request):
         cart=get_object_or_404(Cart,buyer=self.request.user)
-        cart.cart_items.all().delete()
+        cart.cart_items.all().delete()  # a single DELETE, the cart cache is invalidated once below
+        invalidate_cart_cache(request.user.pk)
         return Response({"status": "success", "message": "Cart cleared successfully"}, status=status.HTTP_200_OK)
 
 
@@ -180,16 +331,26 @@ class OrderViewSet(viewsets.ModelViewSet):
     CRUD orders of a user
     """
     permission_classes = [IsOrderByBuyerOrAdmin]
+    pagination_class = OrderPagination
 
     print('creating order')
     def get_serializer_class(self):
         if self.action in ("create", "update", "partial_update", "destroy"):
             return OrderWriteSerializer
+        if self.action == 'list':
+            return OrderSummarySerializer
         return OrderReadSerializer
 
     def get_queryset(self):
         user = self.request.user
-        return Order.objects.filter(buyer=user)
+        if self.action == 'list':
+            # order history, summary columns only, the items are on the detail endpoint
+            return Order.objects.filter(buyer=user).select_related('first_product').only(
+                'id', 'status', 'item_count', 'total_amount', 'created_at', 'buyer',
+                'first_product__id', 'first_product__img', 'first_product__img_variants',
+            )
+        items = Prefetch('order_items', queryset=OrderItem.objects.with_cost())
+        return Order.objects.filter(buyer=user).select_related('buyer').prefetch_related(items)
     
 
     def get_permissions(self):
@@ -201,16 +362,83 @@ class OrderViewSet(viewsets.ModelViewSet):
 
 
 class ReviewViewSet(viewsets.ModelViewSet):
+    """
+    Public review feed of a product, newest (default) or most helpful (``?ordering=-helpful_count``) first.
+    Anyone can read, authenticated users write and only change their own review.
+    """
     serializer_class = ReviewSerializer
+    pagination_class = ReviewPagination
+    permission_classes = [IsAuthenticatedOrReadOnly]
+    filter_backends = [OrderingFilter]
+    ordering_fields = ['created_at', 'helpful_count']
+    ordering = ['-created_at']
 
     def get_queryset(self):
-        product_id = self.kwargs.get('product_id',None)
-        if product_id is not None:
-            return Review.objects.filter(user=self.request.user, product__id=product_id)
-        raise ValidationError("Product id not specified !!")
+        queryset = Review.objects.filter(product_id=self.kwargs['product_id']).select_related('user')
+        if self.action in ('update', 'partial_update', 'destroy'):
+            queryset = queryset.filter(user=self.request.user)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get(self.paginator.cursor_query_param):
+            return super().list(request, *args, **kwargs)
+        # the first page is what nearly every visitor of a product reads, serve it from the cache
+        product_id = self.kwargs['product_id']
+        params = [OrderingFilter.ordering_param, self.paginator.page_size_query_param]
+        key = catalog_cache_key(f'reviews:{product_id}', request, params)
+        build = lambda: super(ReviewViewSet, self).list(request, *args, **kwargs).data
+        return cached_catalog_response(request, key, get_review_feed_version(product_id), build)
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        product = get_object_or_404(Product, pk=self.kwargs['product_id'])
+        if Review.objects.filter(product=product, user=self.request.user).exists():
+            raise ValidationError({'detail': 'You have already reviewed this product.'})
+        serializer.save(user=self.request.user, product=product)
+
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
+    def helpful(self, request, product_id=None, pk=None):
+        """Mark a review as helpful, once per user"""
+        review = self.get_object()
+        if review.user_id == request.user.pk:
+            raise ValidationError({'detail': 'You can not vote for your own review.'})
+        with transaction.atomic():
+            vote, created = ReviewVote.objects.get_or_create(review=review, user=request.user)
+            if created:
+                Review.objects.filter(pk=review.pk).update(helpful_count=F('helpful_count') + 1)
+                invalidate_review_feeds(review.product_id)
+        helpful_count = Review.objects.filter(pk=review.pk).values_list('helpful_count', flat=True).get()
+        return Response({'helpful_count': helpful_count}, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+class SellerAnalyticsViewSet(viewsets.ViewSet):
+    """
+    Sales of the current seller over ``?start=YYYY-MM-DD&end=YYYY-MM-DD`` (last 30 days by default),
+    read from the daily rollups kept up to date by the ``rollup_seller_stats`` command
+    """
+    permission_classes = [IsSeller]
+
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """Revenue, units, orders, views and views-to-order conversion of the whole range"""
+        start, end = parse_date_range(request.query_params)
+        return Response(seller_summary(request.user, start, end))
+
+    @action(detail=False, methods=['get'])
+    def daily(self, request):
+        """The same metrics per day"""
+        start, end = parse_date_range(request.query_params)
+        return Response(seller_daily(request.user, start, end))
+
+    @action(detail=False, methods=['get'], url_path='top-products')
+    def top_products(self, request):
+        """Best products by ``?sort=revenue|units|orders|views``, ``?limit=`` of them (at most 100)"""
+        start, end = parse_date_range(request.query_params)
+        try:
+            limit = min(max(int(request.query_params.get('limit', TOP_PRODUCTS_LIMIT)), 1), 100)
+        except ValueError:
+            raise ValidationError({'limit': 'A valid integer is required.'})
+        sort = request.query_params.get('sort', 'revenue')
+        return Response(seller_top_products(request.user, start, end, sort, limit))
+
 
 class AddressViewSet(viewsets.ModelViewSet):
     serializer_class = AddressSerializer